@@ -16,7 +16,7 @@ sys.path.append(os.environ.get("LOGLEAD_PATH"))
 
 from loglead import AnomalyDetector
 from loglead.loaders import *
-from loglead.enhancers import EventLogEnhancer, SequenceEnhancer
+from loglead.enhancers import EventLogEnhancer, SequenceEnhancer, EnhancerCache
 
 
 #import warnings
@@ -42,6 +42,8 @@ def load_config(config_path):
 
 
 config = load_config(args.config_path)
+# Optional on-disk cache for normalization and parsing results. Reused across redraws and runs.
+enhancer_cache = EnhancerCache(config['enhancer_cache']) if config.get('enhancer_cache') else None
 
 
 def proportion_to_float(proportion_str):
@@ -137,7 +139,7 @@ for dataset_name, dataset_info in config['datasets'].items():
         #Kill nulls if they still exist
         df = df.filter(pl.col("m_message").is_not_null())
 
-        enhancer = EventLogEnhancer(df)
+        enhancer = EventLogEnhancer(df, cache=enhancer_cache)
         time_start = time.time()
         parser_params = None
         # In parsing do we normalize the input with regular expression or no
@@ -161,7 +163,7 @@ for dataset_name, dataset_info in config['datasets'].items():
             parser_call = parser['call']
             parser_field = parser['field']
             # Parse
-            enhancer = EventLogEnhancer(df)
+            enhancer = EventLogEnhancer(df, cache=enhancer_cache)
             time_start = time.time()
             method_to_call = getattr(enhancer, parser_call)
             df = method_to_call(**params)
@@ -0,0 +1,95 @@
+# Memory and time of building AnomalyDetector feature matrices on a synthetic 1M sequence frame.
+# Compares the previous Python list based conversion (to_list, to_pandas, np.vstack and COO hstack)
+# against AnomalyDetector._prepare_data that builds float32 matrices from the Polars columns.
+# Each variant runs in its own process and reports the growth of peak RSS over the loaded frame.
+import os
+import sys
+import time
+import argparse
+import resource
+import tempfile
+import multiprocessing
+
+import numpy as np
+import polars as pl
+
+from dotenv import load_dotenv, find_dotenv
+load_dotenv(find_dotenv())
+LOGLEAD_PATH = os.environ.get("LOGLEAD_PATH")
+sys.path.append(os.environ.get("LOGLEAD_PATH"))
+
+from loglead import AnomalyDetector
+
+parser = argparse.ArgumentParser(description='Feature matrix memory test')
+parser.add_argument('-n', dest='rows', type=int, default=1_000_000, help='Number of sequences')
+parser.add_argument('-e', dest='events', type=int, default=20, help='Mean number of events per sequence')
+parser.add_argument('-d', dest='emb_dim', type=int, default=16, help='Embedding dimension')
+args = parser.parse_args()
+
+item_list_col = "e_event_id"
+numeric_cols = ["seq_len", "eve_len_max", "duration_sec"]
+emb_list_col = "e_emb"
+
+
+def create_frame(path):
+    rng = np.random.default_rng(42)
+    lengths = rng.poisson(args.events, args.rows) + 1
+    event_ids = pl.Series("id", rng.integers(0, 50, lengths.sum())).cast(pl.Utf8)
+    df = pl.DataFrame({
+        "seq_id": np.arange(args.rows),
+        "anomaly": rng.random(args.rows) < 0.03,
+        "seq_len": lengths,
+        "eve_len_max": rng.integers(10, 200, args.rows),
+        "duration_sec": rng.random(args.rows) * 100,
+        # Embeddings are stored as lists like in older enhancer output
+        emb_list_col: pl.Series(rng.random((args.rows, args.emb_dim), dtype=np.float32).ravel())
+                        .reshape((args.rows, args.emb_dim)).cast(pl.List(pl.Float32)),
+    })
+    df = df.with_columns(pl.DataFrame({"id": event_ids, "seq": np.repeat(np.arange(args.rows), lengths)})
+                         .group_by("seq", maintain_order=True).agg(pl.col("id"))["id"].alias(item_list_col))
+    df.write_parquet(path)
+
+
+def prepare_python_lists(df):
+    # Conversion used before the Polars based extraction
+    from scipy.sparse import hstack
+    from sklearn.feature_extraction.text import CountVectorizer
+    vectorizer = CountVectorizer(analyzer=lambda x: x)
+    X = vectorizer.fit_transform(df[item_list_col].to_list())
+    X = hstack([X, np.vstack(df[emb_list_col].to_list())])
+    X = hstack([X, df.select(numeric_cols).to_pandas().values])
+    return X
+
+
+def prepare_polars(df):
+    sad = AnomalyDetector(item_list_col=item_list_col, numeric_cols=numeric_cols, emb_list_col=emb_list_col)
+    X, _ = sad._prepare_data(True, df, None)
+    return X
+
+
+def run(name, path, queue):
+    df = pl.read_parquet(path)
+    rss_start = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    time_start = time.time()
+    X = globals()[name](df)
+    duration = time.time() - time_start
+    rss_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux
+    queue.put((duration, (rss_peak - rss_start) / 1024, type(X).__name__, str(X.dtype)))
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "df_seq.parquet")
+        time_start = time.time()
+        create_frame(path)
+        print(f"Created {args.rows} sequences in {time.time() - time_start:.2f}s")
+        ctx = multiprocessing.get_context("spawn")
+        for name in ["prepare_python_lists", "prepare_polars"]:
+            queue = ctx.Queue()
+            process = ctx.Process(target=run, args=(name, path, queue))
+            process.start()
+            duration, peak_mb, matrix_type, dtype = queue.get()
+            process.join()
+            print(f"{name}: {duration:.2f}s, peak memory growth {peak_mb:.0f} MB, "
+                  f"result {matrix_type} {dtype}")
@@ -0,0 +1,72 @@
+# Out-of-core event level training with AnomalyDetector.train_incremental.
+# Events are read from a Parquet file in batches, enhanced with words and fed to partial_fit models
+# through a hashing vectorizer, then evaluated in batches. Peak memory stays at the batch size level.
+# Give an event level Parquet file with m_message and anomaly columns, e.g. Thunderbird saved from
+# ThuSpiLibLoader, with -p. Without it the HDFS sample is repeated and labelled by its sequences.
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+import polars as pl
+from sklearn.metrics import f1_score, roc_auc_score
+
+from dotenv import load_dotenv, find_dotenv
+load_dotenv(find_dotenv())
+LOGLEAD_PATH = os.environ.get("LOGLEAD_PATH")
+sys.path.append(os.environ.get("LOGLEAD_PATH"))
+
+from loglead import AnomalyDetector
+from loglead.enhancers import EventLogEnhancer
+
+parser = argparse.ArgumentParser(description='Incremental training test')
+parser.add_argument('-p', dest='path', type=str, default=None, help='Event level Parquet file')
+parser.add_argument('-c', dest='copies', type=int, default=10, help='Copies of the HDFS sample without -p')
+parser.add_argument('-b', dest='batch_rows', type=int, default=200000, help='Rows per batch')
+parser.add_argument('--test-frac', dest='test_frac', type=float, default=0.2, help='Last fraction used for testing')
+args = parser.parse_args()
+
+
+def peak_memory_mb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+
+
+def create_events(path):
+    df = pl.read_parquet(f"{LOGLEAD_PATH}/samples/hdfs_events_2percent.parquet")
+    seqs = pl.read_parquet(f"{LOGLEAD_PATH}/samples/hdfs_seqs_2percent.parquet")
+    df = df.join(seqs.select("seq_id", "anomaly"), on="seq_id").select("m_message", "anomaly")
+    pl.concat([df] * args.copies).sample(fraction=1.0, shuffle=True, seed=42).write_parquet(path)
+
+
+def enhanced_batches(path, offset, length):
+    source = pl.scan_parquet(path).slice(offset, length)
+    for df in AnomalyDetector.frame_batches(source, args.batch_rows, columns=["m_message", "anomaly"]):
+        enhancer = EventLogEnhancer(df)
+        yield enhancer.words()
+
+
+with tempfile.TemporaryDirectory() as tmp_dir:
+    path = args.path
+    if path is None:
+        path = os.path.join(tmp_dir, "events.parquet")
+        create_events(path)
+    rows = pl.scan_parquet(path).select(pl.len()).collect().item()
+    train_rows = rows - int(args.test_frac * rows)
+    print(f"{rows} events, {train_rows} for training, batches of {args.batch_rows}, "
+          f"peak memory before training {peak_memory_mb():.0f} MB")
+    sad = AnomalyDetector(item_list_col="e_words", print_scores=False, auc_roc=True)
+    for model in ["SGD", "PassiveAggressive", "MiniBatchKMeans", "RarityModel"]:
+        time_start = time.time()
+        sad.train_incremental(enhanced_batches(path, 0, train_rows), model=model)
+        train_time = time.time() - time_start
+        time_start = time.time()
+        df_scores = sad.evaluate_incremental(enhanced_batches(path, train_rows, rows - train_rows))
+        eval_time = time.time() - time_start
+        print(f"{model:<18} train {train_time:7.2f}s  evaluate {eval_time:7.2f}s  "
+              f"F1 {f1_score(df_scores['anomaly'], df_scores['pred_ano']):.4f}  "
+              f"AUC-ROC {roc_auc_score(df_scores['anomaly'], df_scores['pred_ano_proba']):.4f}  "
+              f"peak memory {peak_memory_mb():.0f} MB")
@@ -0,0 +1,69 @@
+# Benchmark of SequenceEnhancer aggregation on full HDFS data (~575k blocks and 11M events).
+# Compares running each sequence enhancer separately against a single aggregate() call,
+# which does one group_by and one join for all features.
+# Set LOGLEAD_PATH and LOG_DATA_PATH in .env, see .env.sample. HDFS is expected in LOG_DATA_PATH/hdfs/
+import gc
+import os
+import sys
+import time
+import argparse
+
+from dotenv import load_dotenv, find_dotenv
+load_dotenv(find_dotenv())
+LOGLEAD_PATH = os.environ.get("LOGLEAD_PATH")
+sys.path.append(os.environ.get("LOGLEAD_PATH"))
+
+from loglead.loaders import HDFSLoader
+from loglead.enhancers import EventLogEnhancer, SequenceEnhancer
+
+full_data = os.environ.get("LOG_DATA_PATH")
+
+parser = argparse.ArgumentParser(description='Sequence aggregation speed test')
+parser.add_argument('-f', dest='frac', type=float, default=1.0,
+                    help='Fraction of HDFS sequences to use')
+parser.add_argument('-r', dest='repeats', type=int, default=3,
+                    help='How many times each variant is run')
+parser.add_argument('--streaming', action='store_true', help='Use Polars streaming engine in aggregate()')
+args = parser.parse_args()
+
+features = ["start_time", "end_time", "time_stamp", "seq_len", "duration", "eve_len", "events", "tokens"]
+# Normalized messages are used as events to avoid spending the benchmark time in parsing
+event_col = "e_message_normalized"
+
+time_start = time.time()
+loader = HDFSLoader(filename=f"{full_data}/hdfs/HDFS.log", labels_file_name=f"{full_data}/hdfs/anomaly_label.csv")
+loader.execute()
+if args.frac < 1:
+    loader.reduce_dataframes(frac=args.frac)
+enhancer = EventLogEnhancer(loader.df)
+enhancer.normalize()
+enhancer.words()
+df = enhancer.length()
+df_seq = loader.df_seq
+print(f"Loaded and enhanced {df.height} events in {df_seq.height} sequences in {time.time() - time_start:.2f}s")
+
+
+def run_separately():
+    seq_enhancer = SequenceEnhancer(df=df, df_seq=df_seq)
+    for feature in features:
+        if feature == "events":
+            seq_enhancer.events(event_col)
+        else:
+            getattr(seq_enhancer, feature)()
+    return seq_enhancer.df_seq
+
+
+def run_aggregate():
+    seq_enhancer = SequenceEnhancer(df=df, df_seq=df_seq)
+    return seq_enhancer.aggregate(features, event_col=event_col, streaming=args.streaming)
+
+
+for name, func in [("separate enhancers", run_separately), ("aggregate()", run_aggregate)]:
+    times = []
+    for _ in range(args.repeats):
+        gc.collect()
+        time_start = time.time()
+        df_result = func()
+        times.append(time.time() - time_start)
+    print(f"{name}: min {min(times):.2f}s, mean {sum(times) / len(times):.2f}s, "
+          f"result shape {df_result.shape}")
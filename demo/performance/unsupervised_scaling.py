@@ -0,0 +1,71 @@
+# Training and prediction time of the unsupervised detectors of AnomalyDetector with increasing data size.
+# Compares the exact models (KMeans, LocalOutlierFactor, OneClassSVM) against the scalable variants
+# (MiniBatchKMeans, SubsampledLOF, NystroemOneClassSVM) on synthetic event count matrices, where anomalies
+# contain rare events. Exact LOF and OneClassSVM are skipped above --exact-max rows.
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+import polars as pl
+from scipy.sparse import csr_matrix
+from sklearn.metrics import roc_auc_score
+
+from dotenv import load_dotenv, find_dotenv
+load_dotenv(find_dotenv())
+LOGLEAD_PATH = os.environ.get("LOGLEAD_PATH")
+sys.path.append(os.environ.get("LOGLEAD_PATH"))
+
+from loglead import AnomalyDetector
+
+parser = argparse.ArgumentParser(description='Unsupervised detector scaling test')
+parser.add_argument('-s', dest='sizes', type=str, default="1e4,1e5,1e6,1e7",
+                    help='Comma separated numbers of training rows')
+parser.add_argument('--exact-max', dest='exact_max', type=float, default=1e5,
+                    help='Largest training size for exact LOF and OneClassSVM')
+parser.add_argument('--events', dest='events', type=int, default=50, help='Number of event types')
+args = parser.parse_args()
+
+
+def create_matrix(rows, rng):
+    # Sequences of event ids. Normal sequences use common events, anomalies have some rare events.
+    n_common = args.events - 5
+    lengths = rng.poisson(15, rows) + 1
+    probs = rng.dirichlet(np.ones(n_common))
+    events = rng.choice(n_common, size=lengths.sum(), p=probs).astype(np.int32)
+    labels = rng.random(rows) < 0.03
+    indptr = np.zeros(rows + 1, dtype=np.int64)
+    np.cumsum(lengths, out=indptr[1:])
+    # About a third of the events of anomalous sequences are rare
+    ano_events = np.repeat(labels, lengths) & (rng.random(len(events)) < 0.3)
+    events[ano_events] = rng.integers(n_common, args.events, ano_events.sum())
+    X = csr_matrix((np.ones(len(events), dtype=np.float32), events, indptr), shape=(rows, args.events))
+    X.sum_duplicates()
+    return X, labels
+
+
+def set_data(sad, X_train, labels_train, X_test, labels_test):
+    sad.X_train, sad.labels_train = X_train, labels_train.tolist()
+    sad.X_train_no_anos, sad.labels_train_no_anos = X_train[~labels_train], labels_train[~labels_train].tolist()
+    sad.X_test, sad.labels_test = X_test, labels_test.tolist()
+    sad.X_test_no_anos, sad.labels_test_no_anos = X_test, labels_test.tolist()
+    sad.test_df = pl.DataFrame({"anomaly": labels_test})
+
+
+rng = np.random.default_rng(42)
+X_test, labels_test = create_matrix(10000, rng)
+for size in [int(float(size)) for size in args.sizes.split(",")]:
+    X_train, labels_train = create_matrix(size, rng)
+    sad = AnomalyDetector(print_scores=False, auc_roc=True)
+    set_data(sad, X_train, labels_train, X_test, labels_test)
+    for name in ["KMeans", "LOF", "OneClassSVM"]:
+        for scalable in [False, True]:
+            if not scalable and name != "KMeans" and size > args.exact_max:
+                continue
+            time_start = time.time()
+            getattr(sad, f"train_{name}")(scalable=scalable)
+            df_pred = sad.predict()
+            elapsed = time.time() - time_start
+            auc = roc_auc_score(labels_test, df_pred["pred_ano_proba"].to_numpy())
+            print(f"rows {size:>9}  {type(sad.model).__name__:<20} time {elapsed:8.2f}s  AUC-ROC {auc:.4f}")
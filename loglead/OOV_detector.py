@@ -1,33 +1,111 @@
 import matplotlib.pyplot as plt
 import polars as pl
 import numpy as np
+from .vectorizers import _unique_items
 
 __all__ = ['OOV_detector']
 
 
 class OOV_detector:
-    def __init__(self, len_col, test_df, threshold=1):
+    """ Scores data by the number of out-of-vocabulary (OOV) items, e.g. words or events not seen in training.
+        Works on batches of token lists (Polars List(Utf8) series) with a hashed vocabulary, or on count
+        matrices from AnomalyDetector with the lengths of the item lists given separately.
+        len_col and test_df are only needed by the older matrix interface that reads lengths from test_df.
+    """
+    def __init__(self, len_col=None, test_df=None, threshold=1):
         self.len_col = len_col
         self.test_df = test_df
         self.scores = 0
         self.threshold = threshold
+        self.known_items = None  # Columns seen in training, for count matrices
+        self.vocabulary_hashes = None  # Sorted unique hashes of the training items, for token lists
             
     def fit(self, X_train=None, labels=None):
-        # The "training set" to compare against comes inherently from test data's sparse matrix
-        return
-    
-    def predict(self, X_test):
-        # Give array of 0s if the needed length column is lacking in the df
-        if self.len_col not in self.test_df.columns:
-            print("Column not found for OOVD")
-            return np.zeros(self.test_df.select(pl.count()).item())
+        self.known_items = None
+        self.vocabulary_hashes = None
+        return self.partial_fit(X_train, labels)
+
+    def partial_fit(self, X_batch=None, labels=None):
+        # Adds the items of a new batch to the vocabulary
+        if X_batch is None:
+            return self
+        if self._is_token_lists(X_batch):
+            hashes, _, is_null = self._item_hashes(X_batch)
+            batch_hashes = np.unique(hashes[~is_null])
+            self.vocabulary_hashes = batch_hashes if self.vocabulary_hashes is None \
+                else np.union1d(self.vocabulary_hashes, batch_hashes)
+        else:
+            # The vocabulary may have items that are not seen in the training data, e.g. anomalies are filtered out.
+            # Only count the items that have occurrences as known.
+            batch_known = (np.asarray(X_batch.sum(axis=0)).ravel() > 0).astype(np.float64)
+            if self.known_items is None:
+                self.known_items = batch_known
+            else:
+                if len(batch_known) > len(self.known_items):
+                    self.known_items = np.pad(self.known_items, (0, len(batch_known) - len(self.known_items)))
+                self.known_items[:len(batch_known)] = np.maximum(self.known_items[:len(batch_known)], batch_known)
+        return self
+
+    def predict(self, X_test, lengths=None):
+        # X_test is a series of token lists, or a count matrix. For a matrix the item list lengths are
+        # needed to count the items outside the vectorizer vocabulary. Without them only the vocabulary
+        # items not seen in training are counted.
+        if self._is_token_lists(X_test):
+            self.scores = self._count_oov(X_test)
         else:
-            msglen = self.test_df[self.len_col]
-            test_word_count_np = np.array(X_test.tocsr().sum(axis=1)).squeeze()
-            test_word_count_series = pl.Series(test_word_count_np)
-            self.scores = np.array(msglen - test_word_count_series)
-            self.is_ano = (self.scores > self.threshold).astype(int)
-            return self.is_ano
+            if lengths is None and self.test_df is not None:
+                if self.len_col not in self.test_df.columns:
+                    # Give array of 0s if the needed length column is lacking in the df
+                    print("Column not found for OOVD")
+                    return np.zeros(self.test_df.select(pl.count()).item())
+                lengths = self.test_df[self.len_col]
+            X_test = X_test.tocsr()
+            known_count = np.asarray(X_test.dot(self.known_items) if self.known_items is not None
+                                     else X_test.sum(axis=1)).ravel()
+            if lengths is None:
+                self.scores = np.asarray(X_test.sum(axis=1)).ravel() - known_count
+            else:
+                self.scores = np.asarray(lengths, dtype=np.float64) - known_count
+        self.is_ano = (self.scores > self.threshold).astype(int)
+        return self.is_ano
+
+    def _count_oov(self, items):
+        hashes, lengths, is_null = self._item_hashes(items)
+        if self.vocabulary_hashes is None or len(self.vocabulary_hashes) == 0:
+            is_oov = ~is_null
+        else:
+            # Membership by binary search in the sorted hashes
+            pos = np.searchsorted(self.vocabulary_hashes, hashes)
+            pos[pos == len(self.vocabulary_hashes)] = 0
+            is_oov = (self.vocabulary_hashes[pos] != hashes) & ~is_null
+        # Sum per list from the list offsets
+        oov_before = np.zeros(len(is_oov) + 1, dtype=np.int64)
+        np.cumsum(is_oov, out=oov_before[1:])
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        return (oov_before[offsets[1:]] - oov_before[offsets[:-1]]).astype(np.float64)
+
+    @staticmethod
+    def _is_token_lists(X):
+        return isinstance(X, (pl.Series, list))
+
+    @staticmethod
+    def _item_hashes(items):
+        # 64-bit hashes of the flattened items and the list lengths. Two 32-bit murmurhashes of each distinct
+        # item, like in HashingItemVectorizer, so the hashes do not change with the Polars version.
+        from sklearn.utils import murmurhash3_32
+        if not isinstance(items, pl.Series):
+            items = pl.Series(items, dtype=pl.List(pl.Utf8))
+        if items.dtype.inner != pl.Utf8:
+            items = items.cast(pl.List(pl.Utf8))
+        lengths = items.list.len().fill_null(0)
+        uniques, item_index = _unique_items(items.filter(lengths > 0).explode())
+        unique_hashes = np.fromiter(
+            ((murmurhash3_32(item, seed=0, positive=True) << 32) | murmurhash3_32(item, seed=1, positive=True)
+             for item in uniques), dtype=np.uint64, count=len(uniques))
+        # Null items get the extra last slot
+        hashes = np.append(unique_hashes, np.uint64(0))[item_index]
+        return hashes, lengths.to_numpy(), item_index == len(uniques)
     
     def custom_plot(self, labels, x_axis_scale=1.0):
         # Double the font size
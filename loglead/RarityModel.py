@@ -1,5 +1,3 @@
-import math
-
 import matplotlib.pyplot as plt
 import numpy as np
 
@@ -12,28 +10,48 @@ class RarityModel:
         self.score_vector = None
         self.scores = None
         self.is_norm = None
+        self.known_items = None
         self.common_threshold = common_threshold
+        self.item_counts = None  # Occurrences of each item (column) in the data seen so far
+        self.total_items = 0
         
     def fit(self, X_train, labels=None):
-        def rarity_score(freq, total_ngrams):
-            normalized_freq = freq / total_ngrams
-            if normalized_freq > self.common_threshold:
-                return 0  #common ngram, rarity score is 0     
-            score = -math.log(normalized_freq) ** 3
-            #currently, there shouldn't be any OOV term inputs (freq==0) 
-            #but if there is, this would give a score that's twice as rare as one with 1 occurence
-            if freq == 0: 
-                return (-math.log(1/total_ngrams) ** 3 )*2
-            return score
-        
-        total_ngrams = X_train.sum()
-        train_counts = np.array(X_train.sum(axis=0))[0]
-        self.score_vector = np.array([rarity_score(count, total_ngrams) for count in train_counts])
+        self.item_counts = None
+        self.total_items = 0
+        return self.partial_fit(X_train, labels)
+
+    def partial_fit(self, X_batch, labels=None):
+        # Adds the item counts of a new batch, e.g. from a live stream, and updates the scores.
+        # Only the counts are kept, not the data. Columns must mean the same items in every batch.
+        # If the vocabulary grows, new items must be added as new last columns.
+        batch_counts = np.asarray(X_batch.sum(axis=0), dtype=np.float64).ravel()
+        if self.item_counts is None:
+            self.item_counts = np.zeros(len(batch_counts))
+        elif len(batch_counts) > len(self.item_counts):
+            self.item_counts = np.pad(self.item_counts, (0, len(batch_counts) - len(self.item_counts)))
+        self.item_counts[:len(batch_counts)] += batch_counts
+        self.total_items += batch_counts.sum()
+        self._update_score_vector()
+        return self
+
+    def _update_score_vector(self):
+        # Rarity score of item is -log(frequency)^3, 0 for common items with frequency over common_threshold.
+        # Items of the vocabulary that do not occur in the data, e.g. seen only in filtered anomalies,
+        # are treated as out of vocabulary: no score and not counted in the normalization
+        known = self.item_counts > 0
+        normalized_freq = np.divide(self.item_counts, self.total_items, out=np.zeros_like(self.item_counts),
+                                    where=known)
+        self.score_vector = np.zeros_like(self.item_counts)
+        self.score_vector[known] = -np.log(normalized_freq[known]) ** 3
+        self.score_vector[normalized_freq > self.common_threshold] = 0  #common ngram, rarity score is 0
+        self.known_items = known.astype(np.float64)
         
     def predict(self, X_test):
         X_test_csr = X_test.tocsr()
         # Getting the count of non-zero elements along axis 1 (columns) for each instance
-        non_zero_counts = np.array(X_test_csr.getnnz(axis=1), dtype=np.float64)  #Convert to float64 here
+        X_test_nonzero = X_test_csr.copy()
+        X_test_nonzero.data = np.ones_like(X_test_nonzero.data, dtype=np.float64)
+        non_zero_counts = np.asarray(X_test_nonzero.dot(self.known_items), dtype=np.float64)  #Convert to float64 here
         non_zero_counts[non_zero_counts == 0] = 1  #ensuring no divisions by 0
         self.scores = X_test_csr.dot(self.score_vector)
         # Ensuring self.scores is a float array
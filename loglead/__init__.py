@@ -1,6 +1,14 @@
+__version__ = "0.0.1"
+
 from .anomaly_detection import AnomalyDetector
 from .OOV_detector import OOV_detector
 from .RarityModel import RarityModel
 from .next_event_prediction import NextEventPredictionNgram
+from .vectorizers import ListVectorizer, EventCountVectorizer, HashingItemVectorizer, ColumnHasher
+from .scalable_detectors import SubsampledLOF, NystroemOneClassSVM
+from .cascade import CascadeDetector
+from .boosters import XGBBoosterClassifier
 
-__all__ = ['AnomalyDetector', 'OOV_detector', 'RarityModel', 'NextEventPredictionNgram']
\ No newline at end of file
+__all__ = ['AnomalyDetector', 'OOV_detector', 'RarityModel', 'NextEventPredictionNgram', 'ListVectorizer',
+           'EventCountVectorizer', 'HashingItemVectorizer', 'ColumnHasher', 'SubsampledLOF', 'NystroemOneClassSVM',
+           'CascadeDetector', 'XGBBoosterClassifier']
\ No newline at end of file
@@ -1,22 +1,26 @@
+import os
+import sys
+import copy
 import time
+import inspect
 from inspect import isclass
+from contextlib import contextmanager
 
 import polars as pl
 import numpy as np
-import pandas as pd
 import matplotlib.pyplot as plt
 #Faster sklearn enabled. See https://intel.github.io/scikit-learn-intelex/latest/
 # Causes problems in RandomForrest. We have to use older version due to tensorflow numpy combatibilities
 # from sklearnex import patch_sklearn
 #patch_sklearn()
-from scipy.sparse import hstack
+from scipy.sparse import hstack, csr_matrix, issparse
 from xgboost import XGBClassifier
-from sklearn.linear_model import LogisticRegression
+from sklearn.linear_model import LogisticRegression, SGDClassifier
 from sklearn.tree import DecisionTreeClassifier
 from sklearn.svm import LinearSVC
 from sklearn.ensemble import IsolationForest
 from sklearn.neighbors import LocalOutlierFactor
-from sklearn.cluster import KMeans
+from sklearn.cluster import KMeans, MiniBatchKMeans
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.svm import OneClassSVM
 from sklearn.metrics import f1_score
@@ -28,13 +32,47 @@ from sklearn.feature_extraction.text import CountVectorizer
 
 from .RarityModel import RarityModel
 from .OOV_detector import OOV_detector
+from .vectorizers import ListVectorizer, EventCountVectorizer, HashingItemVectorizer, ColumnHasher
+from .scalable_detectors import SubsampledLOF, NystroemOneClassSVM
+from .cascade import CascadeDetector
+from .boosters import XGBBoosterClassifier, xgb_training_matrix
 
 __all__ = ['AnomalyDetector']
 
+# Increase when the saved bundle layout changes
+_BUNDLE_FORMAT_VERSION = 1
+
+# Train methods that are not single models and are left out when all models are evaluated
+_NOT_EVALUATED = {"train_model", "train_incremental", "train_cascade"}
+
+
+def _passive_aggressive_model():
+    # PassiveAggressiveClassifier is deprecated in scikit-learn 1.8 in favour of SGDClassifier with
+    # learning_rate="pa1", which older versions do not support
+    import sklearn
+    if tuple(int(part) for part in sklearn.__version__.split(".")[:2]) >= (1, 8):
+        return SGDClassifier, {"loss": "hinge", "penalty": None, "learning_rate": "pa1", "eta0": 1.0}, False
+    from sklearn.linear_model import PassiveAggressiveClassifier
+    return PassiveAggressiveClassifier, {}, False
+
+
+# Models of train_incremental: class, default parameters and whether anomalies are filtered by default
+_INCREMENTAL_MODELS = {
+    "SGD": (SGDClassifier, {"loss": "log_loss"}, False),
+    "PassiveAggressive": _passive_aggressive_model(),
+    "MiniBatchKMeans": (MiniBatchKMeans, {"n_clusters": 2, "n_init": "auto"}, False),
+    "RarityModel": (RarityModel, {"threshold": 250}, True),
+}
+
+# Models that are trained on the projected matrix when AnomalyDetector.projection is set
+_PROJECTED_MODELS = (IsolationForest, LocalOutlierFactor, KMeans, MiniBatchKMeans, OneClassSVM, SubsampledLOF,
+                     NystroemOneClassSVM)
+
 
 class AnomalyDetector:
     def __init__(self, item_list_col=None, numeric_cols=None, emb_list_col=None, label_col="anomaly", 
-                 store_scores=False, print_scores=True, auc_roc=False):
+                 store_scores=False, print_scores=True, auc_roc=False, projection=None, projection_components=100,
+                 profile=False):
         self.item_list_col = item_list_col
         self.numeric_cols = numeric_cols if numeric_cols else []
         self.label_col = label_col
@@ -44,125 +82,562 @@ class AnomalyDetector:
         self.print_scores=print_scores
         self.train_vocabulary = None
         self.auc_roc = auc_roc
+        self._prepared_data = None  # Data and settings used for the current feature matrices
+        self.model_n_jobs = None  # n_jobs for models that support it, None uses the model default
+        self.scalable_rows = 100000  # Training rows over which train_LOF, train_KMeans and train_OneClassSVM scale
+        self.batch_stats = []  # Rows and timings in milliseconds of score_batch calls
+        self._calibrated_svc = None  # (model, calibrated model) for LinearSVC probabilities
+        self._score_cache = {}  # Predictions of the current model, see _cached_predict_scores
+        # Dimensionality reduction before the distance and tree based unsupervised models, see _PROJECTED_MODELS.
+        # "svd" (TruncatedSVD), "random" (SparseRandomProjection), "hashing" (ColumnHasher) or None
+        self.projection = projection
+        self.projection_components = projection_components
+        self.model_projector = None  # Projection fitted for the current model, None if it uses the raw matrix
+        self._projection_cache = None  # Projected matrices of the current feature matrices, see _projected_matrices
+        self.cascade_stats = []  # Forwarded items and timings in milliseconds of cascade predictions
+        self.event_df = None  # Event level frame of use_event_counts
+        self.event_seq_col = None  # Sequence id column of the event counts, None when item lists are used
+        self._native_cache = None  # Model specific conversions of the training matrix, see _native_matrix
+        # With profile=True the split, feature, training and prediction steps are recorded to profile_records,
+        # see profile_df. Profiling resets the peak memory of the process on Linux at each step.
+        self.profile = profile
+        self.profile_records = []
 
-    def test_train_split(self, df, test_frac=0.9, shuffle=True, vectorizer_class=CountVectorizer):
-        # Shuffle the DataFrame
-        if shuffle:
-            df = df.sample(fraction = 1.0, shuffle=True)
-        elif 'start_time' in df.columns:
-            df = df.sort('start_time')
-        #Do we need this or sequence based quaranteed to be in correct order
-        elif "m_timestamp" in df.columns:
-            df = df.sort('m_timestamp')   
-        # Split ratio
-        test_size = int(test_frac * df.shape[0])
-
-        # Split the DataFrame using head and tail
-        self.train_df = df.head(-test_size) #Returns all rows expect last abs(-test_size)
-        self.test_df = df.tail(test_size) #Returns the last test_size rows
-        self.prepare_train_test_data(vectorizer_class=vectorizer_class)
+    def test_train_split(self, df, test_frac=0.9, shuffle=True, vectorizer_class=None):
+        with self._profiled("test_train_split") as record:
+            # Shuffle the DataFrame
+            if shuffle:
+                df = df.sample(fraction = 1.0, shuffle=True)
+            elif 'start_time' in df.columns:
+                df = df.sort('start_time')
+            #Do we need this or sequence based quaranteed to be in correct order
+            elif "m_timestamp" in df.columns:
+                df = df.sort('m_timestamp')   
+            # Split ratio
+            test_size = int(test_frac * df.shape[0])
+
+            # Split the DataFrame using head and tail
+            self.train_df = df.head(-test_size) #Returns all rows expect last abs(-test_size)
+            self.test_df = df.tail(test_size) #Returns the last test_size rows
+            self.prepare_train_test_data(vectorizer_class=vectorizer_class)
+            record["X"] = self.X_train
         
-    def prepare_train_test_data(self, vectorizer_class=CountVectorizer):
-        #Prepare all data for running
+    def prepare_train_test_data(self, vectorizer_class=None):
+        # Features are built once per split and predictor columns. Calling again without changes does nothing,
+        # so evaluate_all_ads and evaluate_with_params always reuse the same matrices.
+        # Frames are compared by identity and kept referenced so that a new split is always detected
+        settings = (self.item_list_col, tuple(self.numeric_cols or []), self.emb_list_col, self.label_col,
+                    vectorizer_class)
+        if (self._prepared_data is not None and self._prepared_data[0] is self.train_df
+                and self._prepared_data[1] is self.test_df and self._prepared_data[2] == settings):
+            return
+        #Prepare all data for running. Vectorizer is fitted once with the training data.
         self.X_train, self.labels_train = self._prepare_data(True, self.train_df, vectorizer_class)
         self.X_test, self.labels_test = self._prepare_data(False, self.test_df, vectorizer_class)
-        #No anomalies dataset is used for some unsupervised algos. 
-        self.X_train_no_anos, _ = self._prepare_data(True, self.train_df.filter(pl.col(self.label_col).not_()),
-                                                     vectorizer_class)
-        self.X_test_no_anos, self.labels_test_no_anos = self._prepare_data(False, self.test_df, vectorizer_class)
+        #No anomalies dataset is used for some unsupervised algos. Row slice of the train matrix.
+        #Vocabulary is from all training data, models needing the vocabulary of normal data only
+        #(RarityModel, OOV_detector) see it from the zero columns of the sliced matrix.
+        normal_rows = ~np.array(self.labels_train, dtype=bool)
+        self.X_train_no_anos = self.X_train[normal_rows]
+        self.labels_train_no_anos = [label for label, normal in zip(self.labels_train, normal_rows) if normal]
+        self.X_test_no_anos, self.labels_test_no_anos = self.X_test, self.labels_test
+        self._prepared_data = (self.train_df, self.test_df, settings)
      
+    def use_event_counts(self, df, event_col="e_event_drain_id", seq_col="seq_id"):
+        # Sequence item features are counted straight from the event level frame df with EventCountVectorizer,
+        # so no list column from SequenceEnhancer.events is needed. Rows and labels follow the sequence frame
+        # given to test_train_split. To score new sequences with a trained detector, give their events here.
+        self.item_list_col = event_col
+        self.event_seq_col = seq_col
+        self.event_df = df.select(seq_col, event_col)
+        self._prepared_data = None
+
     def _prepare_data(self, train, df_seq, vectorizer_class):
-        X = None
-        labels = df_seq.select(pl.col(self.label_col)).to_series().to_list()
+        with self._profiled("prepare_train" if train else "prepare_test") as record:
+            labels = df_seq.select(pl.col(self.label_col)).to_series().to_list()
+            record["X"] = self._prepare_features(train, df_seq, vectorizer_class)
+        return record["X"], labels
 
+    def _prepare_features(self, train, df_seq, vectorizer_class=None):
+        X = None
+        # Count events from the event level frame, see use_event_counts
+        if self.event_seq_col is not None:
+            if self.event_df is None:
+                raise ValueError("Event counts need the event level frame. Give it with use_event_counts.")
+            seq_ids = df_seq[self.event_seq_col]
+            if train:
+                self.vectorizer = EventCountVectorizer(self.item_list_col, self.event_seq_col)
+                X = self.vectorizer.fit_transform(self.event_df, seq_ids)
+                self.train_vocabulary = self.vectorizer.vocabulary_
+            else:
+                X = self.vectorizer.transform(self.event_df, seq_ids)
         # Extract events
-        if self.item_list_col:
+        elif self.item_list_col:
             # Extract the column
-            column_data = df_seq.select(pl.col(self.item_list_col))             
-            events = column_data.to_series().to_list()
+            column_data = df_seq.select(pl.col(self.item_list_col)).to_series()
             # We are training
             if train:
                 # Check the datatype  
-                if column_data.dtypes[0]  == pl.datatypes.Utf8: #We get strs -> Use SKlearn Tokenizer
-                    self.vectorizer = vectorizer_class() 
-                elif column_data.dtypes[0]  == pl.datatypes.List(pl.datatypes.Utf8): #We get list of str, e.g. words -> Do not use Skelearn Tokinizer 
-                    self.vectorizer = vectorizer_class(analyzer=lambda x: x)
-                X = self.vectorizer.fit_transform(events)
+                if isinstance(vectorizer_class, HashingItemVectorizer):
+                    # Configured instance, e.g. HashingItemVectorizer(n_features=2**16, alternate_sign=True)
+                    self.vectorizer = copy.copy(vectorizer_class)
+                elif vectorizer_class is HashingItemVectorizer:
+                    self.vectorizer = HashingItemVectorizer()
+                elif column_data.dtype == pl.datatypes.Utf8: #We get strs -> Use SKlearn Tokenizer
+                    self.vectorizer = (vectorizer_class or CountVectorizer)()
+                elif isinstance(column_data.dtype, pl.datatypes.List): #We get list of str, e.g. words -> Do not use Skelearn Tokinizer 
+                    if vectorizer_class is None or vectorizer_class is ListVectorizer:
+                        self.vectorizer = ListVectorizer()  #Builds the matrix from the Polars column directly
+                    else:
+                        self.vectorizer = vectorizer_class(analyzer=_identity_analyzer)
+                else:
+                    raise ValueError(f"Column {self.item_list_col} should be Utf8 or List, got {column_data.dtype}")
+                X = self.vectorizer.fit_transform(self._vectorizer_input(column_data))
                 self.train_vocabulary = self.vectorizer.vocabulary_
+                collisions = getattr(self.vectorizer, "collision_stats_", None)
+                if collisions and collisions["collision_rate"] > 0.05:
+                    print(f"WARNING! {collisions['collision_rate']:.1%} of the {collisions['items']} items of "
+                          f"{self.item_list_col} share a hashed column. Consider more n_features.")
 
             # We are predicting
             else:
-                X = self.vectorizer.transform(events)
+                X = self.vectorizer.transform(self._vectorizer_input(column_data))
 
         # Extract lists of embeddings
         if  self.emb_list_col:
-            emb_list = df_seq.select(pl.col(self.emb_list_col)).to_series().to_list()
-            
-            # Convert lists of floats to a matrix
-            #emb_matrix = np.array(emb_list)
-            emb_matrix = np.vstack(emb_list)
+            emb_matrix = self._float32_matrix(df_seq.select(pl.col(self.emb_list_col)).to_series())
             # Stack with X
-            X = hstack([X, emb_matrix]) if X is not None else emb_matrix
+            X = self._stack_features(X, emb_matrix)
 
         # Extract additional predictors
         if self.numeric_cols:
-            additional_features = df_seq.select(self.numeric_cols).to_pandas().values
-            X = hstack([X, additional_features]) if X is not None else additional_features
+            additional_features = df_seq.select(pl.col(self.numeric_cols).cast(pl.Float32)).to_numpy()
+            X = self._stack_features(X, additional_features)
+
+        return X
 
-        return X, labels    
+    @staticmethod
+    def _float32_matrix(emb_col):
+        # Array columns convert to a 2D array directly, equal length lists are reshaped from the flat values
+        if isinstance(emb_col.dtype, pl.datatypes.List):
+            widths = emb_col.list.len().unique()
+            if len(widths) != 1 or widths[0] is None:
+                raise ValueError(f"Embeddings in {emb_col.name} have different lengths: {widths.to_list()}")
+            return emb_col.explode().cast(pl.Float32).to_numpy().reshape(len(emb_col), widths[0])
+        return emb_col.cast(pl.Array(pl.Float32, emb_col.dtype.width)).to_numpy()
+
+    @staticmethod
+    def _stack_features(X, dense):
+        # Dense features alone stay dense for the models. With item counts everything goes to one float32 CSR.
+        if X is None:
+            return dense
+        if not issparse(X):
+            return np.hstack([X, dense])
+        return hstack([X.astype(np.float32), csr_matrix(dense)], format="csr")
+
+    def _vectorizer_input(self, column_data):
+        # ListVectorizer and HashingItemVectorizer read the Polars column, sklearn vectorizers need Python lists
+        if isinstance(self.vectorizer, (ListVectorizer, HashingItemVectorizer)):
+            return column_data
+        return column_data.to_list()
         
     def train_model(self, model,  /, *, filter_anos=False, **model_kwargs):
-        X_train_to_use = self.X_train_no_anos if filter_anos else self.X_train
-        #Store the current the model and whether it uses ano data or no
-        if isclass(model):
-            self.model = model(**model_kwargs)
-        else:
-            self.model = model  # Backwards compatibility with previous implementation
-        self.filter_anos = filter_anos
-        self.model.fit(X_train_to_use, self.labels_train)
+        with self._profiled("train") as record:
+            labels_to_use = self.labels_train_no_anos if filter_anos else self.labels_train
+            #Store the current the model and whether it uses ano data or no
+            if isclass(model):
+                self.model = model(**model_kwargs)
+            else:
+                self.model = model  # Backwards compatibility with previous implementation
+            self.filter_anos = filter_anos
+            self.model_projector = self._projector_for(self.model)
+            X_train_to_use = self._matrix("X_train_no_anos" if filter_anos else "X_train")
+            self._calibrated_svc = None
+            self._score_cache = {}
+            # Limit the threads of multi-threaded models, e.g. in parallel evaluation. n_jobs of LogisticRegression
+            # has no effect for binary labels and warns in scikit-learn 1.8, so it is left as is.
+            if self.model_n_jobs is not None and "n_jobs" not in model_kwargs and hasattr(self.model, "get_params") \
+                    and "n_jobs" in self.model.get_params() and not isinstance(self.model, LogisticRegression):
+                self.model.set_params(n_jobs=self.model_n_jobs)
+            record["X"] = X_train_to_use
+            self.model.fit(X_train_to_use, labels_to_use)
+            record["model"] = _model_name(self.model)
 
     def predict(self, custom_plot=False):
         #Binary scores
-        X_test_to_use = self.X_test_no_anos if self.filter_anos else self.X_test
-        predictions = self.model.predict(X_test_to_use)
+        X_test_to_use = self._test_matrix()
+        predictions, predictions_proba = self._cached_predict_scores(X_test_to_use)
+        df_seq = self.test_df.with_columns(pl.Series(name="pred_ano", values=predictions.tolist()))
+        if predictions_proba is not None:
+            df_seq = self.test_df.with_columns(pl.Series(name="pred_ano_proba", values=predictions_proba.tolist()))      
+        self._report_scores(predictions, predictions_proba, custom_plot)
+        return df_seq 
+
+    def score(self, df):
+        # Lean prediction path for new data, e.g. with a detector from load(). Needs only the predictor
+        # columns in df, no labels or train/test split. Returns df with pred_ano and pred_ano_proba.
+        df, _, _ = self._score_timed(df)
+        return df
+
+    def score_batch(self, df, latency_budget_ms=None):
+        # Scores one micro-batch and records the transform and model time to self.batch_stats
+        df, transform_ms, model_ms = self._score_timed(df)
+        total_ms = transform_ms + model_ms
+        self.batch_stats.append({
+            "rows": df.height,
+            "transform_ms": transform_ms,
+            "model_ms": model_ms,
+            "total_ms": total_ms,
+            "over_budget": latency_budget_ms is not None and total_ms > latency_budget_ms,
+        })
+        return df
+
+    def score_stream(self, batches, latency_budget_ms=None, max_batch_rows=None):
+        # Scores an iterable of event or sequence frames and yields the scored micro-batches.
+        # With a latency budget incoming frames are split so that a micro-batch is expected to
+        # take at most 80% of the budget. The expected time is a linear fit of fixed cost and cost
+        # per row over the recent batches. max_batch_rows is also the size of the first batch.
+        # When the fixed cost alone is over the budget, smaller batches would only lower the throughput,
+        # so batches are kept at max_batch_rows and marked over_budget in batch_stats.
+        batch_rows = max_batch_rows
+        history = []
+        for df in batches:
+            offset = 0
+            while offset < df.height:
+                if latency_budget_ms is not None and history:
+                    batch_rows = self._rows_for_budget(history, latency_budget_ms)
+                    if batch_rows is None:
+                        batch_rows = max_batch_rows
+                    elif max_batch_rows is not None:
+                        batch_rows = min(batch_rows, max_batch_rows)
+                length = batch_rows if batch_rows else df.height
+                scored = self.score_batch(df.slice(offset, length), latency_budget_ms)
+                offset += length
+                history = history[-19:] + [(scored.height, self.batch_stats[-1]["total_ms"])]
+                yield scored
+
+    @staticmethod
+    def _rows_for_budget(history, budget_ms):
+        # Rows expected to take 80% of the budget, None if the budget can not be met
+        target_ms = 0.8 * budget_ms
+        rows, ms = np.array(history, dtype=np.float64).T
+        if len(np.unique(rows)) > 1:
+            ms_per_row, fixed_ms = np.polyfit(rows, ms, 1)
+            fixed_ms = max(fixed_ms, 0)
+        else:
+            ms_per_row, fixed_ms = 0, 0
+        if ms_per_row <= 0:
+            ms_per_row, fixed_ms = ms.sum() / max(rows.sum(), 1), 0
+        if fixed_ms >= target_ms:
+            return None
+        target_rows = max(1, int((target_ms - fixed_ms) / ms_per_row)) if ms_per_row > 0 else int(rows.max()) * 2
+        # The fit can not see a fixed cost when all the batches have the same size. Batches that were already
+        # this small and still went over the budget show that it can not be met.
+        if np.any((rows <= target_rows) & (ms > budget_ms)):
+            return None
+        return target_rows
+
+    def _score_timed(self, df):
+        if not hasattr(self, "model"):
+            raise ValueError("No trained model. Train a model or load a saved detector first.")
+        time_start = time.perf_counter()
+        with self._profiled("transform") as record:
+            X = self._prepare_features(False, df)
+            if self.model_projector is not None:
+                X = self.model_projector.transform(X)
+            record["X"] = X
+        time_transformed = time.perf_counter()
+        predictions, predictions_proba = self._predict_scores(X, df)
+        time_predicted = time.perf_counter()
+        df = df.with_columns(pl.Series(name="pred_ano", values=predictions))
+        if predictions_proba is not None:
+            df = df.with_columns(pl.Series(name="pred_ano_proba", values=predictions_proba))
+        return df, (time_transformed - time_start) * 1000, (time_predicted - time_transformed) * 1000
+
+    def _predict_scores(self, X_test_to_use, df=None):
+        # df is the frame of X_test_to_use, self.test_df by default
+        with self._profiled("predict") as record:
+            record["X"] = X_test_to_use
+            record["model"] = _model_name(self.model)
+            return self._model_scores(X_test_to_use, df)
+
+    def _model_scores(self, X_test_to_use, df):
+        if isinstance(self.model, CascadeDetector):
+            return self._predict_cascade(X_test_to_use, df)
+        if isinstance(self.model, OOV_detector):
+            predictions = self.model.predict(X_test_to_use, lengths=self._oov_lengths(df))
+        else:
+            predictions = self.model.predict(X_test_to_use)
         #Unsupervised modeles give predictions between -1 and 1. Convert to 0 and 1
-        if isinstance(self.model, (IsolationForest, LocalOutlierFactor,KMeans, OneClassSVM)):
+        if isinstance(self.model, (IsolationForest, LocalOutlierFactor,KMeans, OneClassSVM, MiniBatchKMeans,
+                                   SubsampledLOF, NystroemOneClassSVM)):
             predictions = np.where(predictions < 0, 1, 0)
-        df_seq = self.test_df.with_columns(pl.Series(name="pred_ano", values=predictions.tolist()))
         
         #Continuous scores
         predictions_proba = None
         if self.auc_roc:
-            if isinstance(self.model, (IsolationForest, LocalOutlierFactor, OneClassSVM)):
+            if isinstance(self.model, (IsolationForest, LocalOutlierFactor, OneClassSVM, SubsampledLOF,
+                                       NystroemOneClassSVM)):
                 # Unsupervised models give anomaly scores or decision function values
                 predictions_proba = 1- self.model.decision_function(X_test_to_use)
-            elif isinstance(self.model, (KMeans)):
+            elif isinstance(self.model, (KMeans, MiniBatchKMeans)):
                 from sklearn.metrics.pairwise import pairwise_distances
                 predictions_proba = np.min(pairwise_distances(X_test_to_use, self.model.cluster_centers_), axis=1)
             elif isinstance(self.model, LinearSVC):
                 # LinearSVC does not have predict_proba method by default
                 # Use decision_function method to obtain confidence scores
                 # and convert them to probabilities using Platt scaling
-                from sklearn.calibration import CalibratedClassifierCV
-                X_train_to_use = self.X_train_no_anos if  self.filter_anos else self.X_train
-                calibrated_model = CalibratedClassifierCV(self.model, cv='prefit')
-                calibrated_model.fit(X_train_to_use, self.labels_train)
+                calibrated_model = self._calibrated_model()
+                if calibrated_model is None:
+                    # Loaded detectors have no training data for calibration, the margin still ranks the samples
+                    return predictions, self.model.decision_function(X_test_to_use)
                 predictions_proba = calibrated_model.predict_proba(X_test_to_use)[:, 1]
             elif isinstance(self.model, (OOV_detector, RarityModel)):
                 predictions_proba = self.model.scores    
-            else:
+            elif hasattr(self.model, "predict_proba"):
                 # Supervised models give probabilities using predict_proba method
                 predictions_proba = self.model.predict_proba(X_test_to_use)[:, 1]
-            df_seq = self.test_df.with_columns(pl.Series(name="pred_ano_proba", values=predictions_proba.tolist()))      
+            else:
+                # Margin classifiers, e.g. hinge loss SGDClassifier, rank with the decision function
+                predictions_proba = self.model.decision_function(X_test_to_use)
+        return predictions, predictions_proba
+
+    def _predict_cascade(self, X_test_to_use, df=None):
+        # Cheap scores of all items, expensive model only for the forwarded items
+        df = self.test_df if df is None else df
+        cascade = self.model
+        time_start = time.perf_counter()
+        forward = cascade.forward_mask(self._cheap_scores(cascade.cheap, X_test_to_use, df))
+        forwarded = np.flatnonzero(forward)
+        time_cheap = time.perf_counter()
+        predictions = np.zeros(X_test_to_use.shape[0], dtype=int)
+        predictions_proba = np.zeros(X_test_to_use.shape[0]) if self.auc_roc else None
+        if len(forwarded):
+            X_forwarded = X_test_to_use[forwarded]
+            if cascade.expensive_projector is not None:
+                X_forwarded = cascade.expensive_projector.transform(X_forwarded)
+            self.model = cascade.expensive
+            try:
+                forwarded_predictions, forwarded_proba = self._predict_scores(X_forwarded, df[forwarded])
+            finally:
+                self.model = cascade
+            predictions[forwarded] = forwarded_predictions
+            if predictions_proba is not None:
+                # Items that were not forwarded rank below all the forwarded ones
+                predictions_proba[:] = np.min(forwarded_proba) - 1
+                predictions_proba[forwarded] = forwarded_proba
+        time_end = time.perf_counter()
+        stats = {
+            "rows": len(forward),
+            "forwarded": len(forwarded),
+            "forwarded_frac": len(forwarded) / len(forward) if len(forward) else 0.0,
+            "cheap_ms": (time_cheap - time_start) * 1000,
+            "expensive_ms": (time_end - time_cheap) * 1000,
+            "rows_per_second": len(forward) / (time_end - time_start) if time_end > time_start else None,
+            "anomaly_recall": None,  # Share of the labelled anomalies that were forwarded
+        }
+        if self.label_col in df.columns:
+            labels = df[self.label_col].to_numpy().astype(bool)
+            if labels.any():
+                stats["anomaly_recall"] = float(forward[labels].mean())
+        self.cascade_stats.append(stats)
+        return predictions, predictions_proba
 
+    def _cheap_scores(self, cheap, X, df):
+        if isinstance(cheap, str):
+            return df[cheap].to_numpy()
+        if isinstance(cheap, OOV_detector):
+            cheap.predict(X, lengths=self._oov_lengths(df, cheap))
+        else:
+            cheap.predict(X)
+        return cheap.scores
+
+    def _oov_lengths(self, df=None, model=None):
+        # Item list lengths count also the items that are outside the vectorizer vocabulary
+        df = self.test_df if df is None else df
+        model = self.model if model is None else model
+        if model.len_col in df.columns:
+            return df[model.len_col]
+        if self.event_seq_col is not None and self.event_df is not None and self.event_seq_col in df.columns:
+            lengths = self.event_df.group_by(self.event_seq_col).agg(pl.len().alias("length"))
+            return df.select(self.event_seq_col).join(lengths, on=self.event_seq_col, how="left")["length"].fill_null(0)
+        if self.item_list_col in df.columns and isinstance(df.schema[self.item_list_col], pl.List):
+            return df[self.item_list_col].list.len()
+        if f"{self.item_list_col}_len" in df.columns:  # Worker frames have the lengths instead of the lists
+            return df[f"{self.item_list_col}_len"]
+        print("Column not found for OOVD")
+        return None
+
+    def _calibrated_model(self):
+        # Platt scaling of LinearSVC is fitted once per trained model and reused in later predictions
+        if self._calibrated_svc is not None and self._calibrated_svc[0] is self.model:
+            return self._calibrated_svc[1]
+        if getattr(self, "X_train", None) is None:
+            return None
+        from sklearn.calibration import CalibratedClassifierCV
+        X_train_to_use = self.X_train_no_anos if  self.filter_anos else self.X_train
+        labels_to_use = self.labels_train_no_anos if self.filter_anos else self.labels_train
+        try:
+            # cv='prefit' was replaced by FrozenEstimator in scikit-learn 1.6
+            from sklearn.frozen import FrozenEstimator
+            calibrated_model = CalibratedClassifierCV(FrozenEstimator(self.model))
+        except ImportError:
+            calibrated_model = CalibratedClassifierCV(self.model, cv='prefit')
+        calibrated_model.fit(X_train_to_use, labels_to_use)
+        self._calibrated_svc = (self.model, calibrated_model)
+        return calibrated_model
+
+    def _cached_predict_scores(self, X_test_to_use):
+        # Repeated predict() calls of the same model on the same test matrix reuse the scores.
+        # Objects are kept in the cache so that their ids cannot be reused by new objects.
+        key = (id(self.model), id(X_test_to_use), self.auc_roc)
+        cached = self._score_cache.get(key)
+        if cached is None or cached[0] is not self.model or cached[1] is not X_test_to_use:
+            cached = (self.model, X_test_to_use, *self._predict_scores(X_test_to_use))
+            self._score_cache[key] = cached
+        return cached[2], cached[3]
+
+    def _report_scores(self, predictions, predictions_proba, custom_plot=False, wall_time=None, peak_memory_mb=None):
         if self.print_scores:
             self._print_evaluation_scores(self.labels_test, predictions,predictions_proba, self.model)
         if custom_plot:
             self.model.custom_plot(self.labels_test)
         if self.store_scores:
-            self.storage.store_test_results(self.labels_test, predictions,predictions_proba, type(self.model).__name__, 
-                                            self.item_list_col, self.numeric_cols, self.emb_list_col)
-        return df_seq 
+            self.storage.store_test_results(self.labels_test, predictions,predictions_proba, _model_name(self.model), 
+                                            self.item_list_col, self.numeric_cols, self.emb_list_col,
+                                            wall_time=wall_time, peak_memory_mb=peak_memory_mb,
+                                            projection=self.projection if self.model_projector is not None else None)
+
+    def _matrix(self, name):
+        # Feature matrix by attribute name for the current model, projected if the model uses the projection
+        if self.model_projector is None:
+            return getattr(self, name)
+        return self._projected_matrices()[name]
+
+    def _test_matrix(self):
+        return self._matrix("X_test_no_anos" if self.filter_anos else "X_test")
+
+    def _projector_for(self, model):
+        if self.projection is None or not isinstance(model, _PROJECTED_MODELS):
+            return None
+        return self._projected_matrices()["projector"]
+
+    def _projected_matrices(self):
+        # The projection is fitted on the training rows once per feature matrices and projection settings
+        # and applied to all the matrices. Matrices are compared by identity like in prepare_train_test_data.
+        settings = (self.projection, self.projection_components)
+        cached = self._projection_cache
+        if cached is not None and cached[0] is self.X_train and cached[1] is self.X_test and cached[2] == settings:
+            return cached[3]
+        time_start = time.perf_counter()
+        projector = _make_projector(self.projection, self.projection_components, self.X_train.shape[1])
+        matrices = {"projector": projector, "seconds": 0.0}
+        if projector is None:
+            print(f"WARNING! Feature matrix has only {self.X_train.shape[1]} columns, "
+                  f"{self.projection} projection to {self.projection_components} is not used")
+        else:
+            projector.fit(self.X_train)
+            for name in ["X_train", "X_train_no_anos", "X_test", "X_test_no_anos"]:
+                X = getattr(self, name)
+                # X_test_no_anos is usually the same matrix as X_test
+                same = [other for other in matrices if other.startswith("X_") and getattr(self, other) is X]
+                matrices[name] = matrices[same[0]] if same else projector.transform(X).astype(np.float32)
+            matrices["seconds"] = time.perf_counter() - time_start
+        self._projection_cache = (self.X_train, self.X_test, settings, matrices)
+        return matrices
+
+    def _native_matrix(self, settings, build):
+        # Model specific conversion of the training matrix, e.g. the XGBoost DMatrix, built once per training
+        # matrix and settings with build(X_train, labels_train). Matrices are compared by identity.
+        if self._native_cache is None or self._native_cache[0] is not self.X_train:
+            self._native_cache = (self.X_train, {})
+        matrices = self._native_cache[1]
+        if settings not in matrices:
+            matrices[settings] = build(self.X_train, self.labels_train)
+        return matrices[settings]
+
+    @contextmanager
+    def _profiled(self, step):
+        # Records wall time, CPU time, peak resident memory and the matrix record["X"] of a step to
+        # profile_records when profiling. Steps are recorded when they end, so nested steps come first.
+        record = {}
+        if not self.profile:
+            yield record
+            return
+        first_nested = len(self.profile_records)
+        _reset_peak_memory()
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        yield record
+        wall_s, cpu_s = time.perf_counter() - wall_start, time.process_time() - cpu_start
+        # Nested steps reset the peak, so the peak of this step is at least theirs
+        peaks = [_peak_memory_mb()] + [r["peak_rss_mb"] for r in self.profile_records[first_nested:]]
+        peaks = [peak for peak in peaks if peak is not None]
+        X = record.get("X")
+        nnz = None
+        if issparse(X):
+            nnz = X.nnz
+        elif isinstance(X, np.ndarray):
+            nnz = int(np.count_nonzero(X))
+        self.profile_records.append({
+            "step": step,
+            "model": record.get("model"),
+            "input_signature": self.storage._create_input_signature(self.item_list_col, self.numeric_cols,
+                                                                    self.emb_list_col),
+            "wall_s": wall_s,
+            "cpu_s": cpu_s,
+            "peak_rss_mb": max(peaks) if peaks else None,
+            "rows": X.shape[0] if X is not None else None,
+            "cols": X.shape[1] if X is not None else None,
+            "nnz": nnz,
+        })
+
+    @property
+    def profile_df(self):
+        # Profiled steps as a Polars frame, e.g. to compare vectorizers or models with group_by("step", "model")
+        return pl.DataFrame(self.profile_records, schema={
+            "step": pl.Utf8, "model": pl.Utf8, "input_signature": pl.Utf8, "wall_s": pl.Float64,
+            "cpu_s": pl.Float64, "peak_rss_mb": pl.Float64, "rows": pl.Int64, "cols": pl.Int64, "nnz": pl.Int64})
+
+    def compare_projections(self, projections=("svd", "random", "hashing"), models=None):
+        # Trains the models of the projection stage on the current split without projection and with each
+        # projection in projections. models is a list of names like in repeated_splits, by default
+        # IsolationForest, LOF, KMeans and OneClassSVM. Returns a Polars DataFrame with the projection time,
+        # the training and prediction time and the scores, and their differences to the raw matrix.
+        if models is None:
+            models = ["IsolationForest", "LOF", "KMeans", "OneClassSVM"]
+        if not isinstance(models, dict):
+            models = {name: {} for name in models}
+        projection_setting = self.projection
+        rows = []
+        try:
+            for projection in [None, *projections]:
+                self.projection = projection
+                for name, params in models.items():
+                    time_start = time.time()
+                    getattr(self, "train_" + name)(**params)
+                    predictions, predictions_proba = self._predict_scores(self._test_matrix())
+                    wall_time = time.time() - time_start
+                    self._report_scores(predictions, predictions_proba, wall_time=wall_time)
+                    rows.append({
+                        "model": _model_name(self.model),
+                        "projection": projection,
+                        "columns": self._test_matrix().shape[1],
+                        "projection_time": self._projected_matrices()["seconds"] if self.model_projector else 0.0,
+                        "time": wall_time,
+                        "accuracy": accuracy_score(self.labels_test, predictions),
+                        "f1": f1_score(self.labels_test, predictions),
+                        "auc_roc": roc_auc_score(self.labels_test, predictions_proba)
+                                   if predictions_proba is not None else None,
+                    })
+        finally:
+            self.projection = projection_setting
+        df = pl.DataFrame(rows)
+        raw = df.filter(pl.col("projection").is_null()).select(
+            "model", *[pl.col(col).alias(col + "_raw") for col in ["time", "accuracy", "f1", "auc_roc"]])
+        return df.join(raw, on="model", how="left").with_columns(
+            (pl.col("projection_time") + pl.col("time") - pl.col("time_raw")).alias("time_delta"),
+            *[(pl.col(col) - pl.col(col + "_raw")).alias(col + "_delta") for col in ["accuracy", "f1", "auc_roc"]],
+        ).drop([col + "_raw" for col in ["time", "accuracy", "f1", "auc_roc"]])
        
     def train_LR(self, max_iter=4000, tol=0.0003):
         self.train_model(LogisticRegression, max_iter=max_iter, tol=tol)
@@ -178,24 +653,88 @@ class AnomalyDetector:
         self.train_model(IsolationForest, filter_anos=filter_anos,
                          n_estimators=n_estimators, max_samples=max_samples, contamination=contamination)
                           
-    def train_LOF(self, n_neighbors=20, contamination="auto", filter_anos=True):
+    def train_LOF(self, n_neighbors=20, contamination="auto", filter_anos=True, scalable="auto"):
         #LOF novelty=True model needs to be trained without anomalies
         #If we set novelty=False then Predict is no longer available for calling.
         #It messes up our general model prediction routine
-        self.train_model(LocalOutlierFactor, filter_anos=filter_anos, n_neighbors=n_neighbors,
-                         contamination=contamination, novelty=True)
+        #Large training data uses a subsampled reference set, see _use_scalable
+        if self._use_scalable(scalable, filter_anos):
+            self.train_model(SubsampledLOF, filter_anos=filter_anos, n_neighbors=n_neighbors,
+                             contamination=contamination)
+        else:
+            self.train_model(LocalOutlierFactor, filter_anos=filter_anos, n_neighbors=n_neighbors,
+                             contamination=contamination, novelty=True)
     
-    def train_KMeans(self):
-        self.train_model(KMeans, n_init="auto", n_clusters=2)
+    def train_KMeans(self, scalable="auto"):
+        if self._use_scalable(scalable):
+            self.train_model(MiniBatchKMeans, n_init="auto", n_clusters=2, batch_size=4096)
+        else:
+            self.train_model(KMeans, n_init="auto", n_clusters=2)
 
-    def train_OneClassSVM(self):
-        self.train_model(OneClassSVM, max_iter=1000)
+    def train_OneClassSVM(self, scalable="auto"):
+        if self._use_scalable(scalable):
+            self.train_model(NystroemOneClassSVM, max_iter=1000)
+        else:
+            self.train_model(OneClassSVM, max_iter=1000)
+
+    def train_cascade(self, expensive="XGB", cheap="RarityModel", target_recall=0.99, expensive_params=None,
+                      cheap_params=None):
+        # Cascade of a cheap scorer and an expensive model, see CascadeDetector. Confidently normal items
+        # are predicted without the expensive model. cheap is "RarityModel", "OOVDetector" or a score column of
+        # the frames, e.g. nep_prob_nmax_perp. expensive is a model name like in evaluate_with_params.
+        # target_recall is the share of training anomalies that must be forwarded to the expensive model.
+        # Each prediction appends the forwarded share, timings and throughput to self.cascade_stats.
+        if cheap in ("RarityModel", "OOVDetector"):
+            getattr(self, "train_" + cheap)(**(cheap_params or {}))
+            cheap_scorer = self.model
+            cheap_scores = self._cheap_scores(cheap_scorer, self.X_train, self.train_df)
+        elif getattr(self, "train_df", None) is not None and cheap in self.train_df.columns:
+            cheap_scorer = cheap
+            cheap_scores = self.train_df[cheap].to_numpy()
+        else:
+            raise ValueError(f"cheap must be 'RarityModel', 'OOVDetector' or a column of the data, got {cheap}")
+        getattr(self, "train_" + expensive)(**(expensive_params or {}))
+        cascade = CascadeDetector(cheap_scorer, self.model, target_recall=target_recall,
+                                  expensive_projector=self.model_projector)
+        cascade.calibrate(cheap_scores, self.labels_train)
+        self.model = cascade
+        self.filter_anos = False
+        self.model_projector = None
+        self._calibrated_svc = None
+        self._score_cache = {}
+
+    def _use_scalable(self, scalable, filter_anos=False):
+        # scalable="auto" switches to the linear time variants when training rows exceed scalable_rows.
+        # Exact LOF and OneClassSVM grow quadratically with rows, KMeans uses mini-batches.
+        if scalable != "auto":
+            return bool(scalable)
+        X_train_to_use = self.X_train_no_anos if filter_anos else self.X_train
+        return X_train_to_use.shape[0] > self.scalable_rows
 
-    def train_RF(self):
-        self.train_model(RandomForestClassifier)
+    def train_RF(self, n_estimators=100, n_jobs=None, **params):
+        # n_jobs None uses model_n_jobs, or one core if it is not set either
+        if n_jobs is not None:
+            params["n_jobs"] = n_jobs
+        self.train_model(RandomForestClassifier, n_estimators=n_estimators, **params)
 
-    def train_XGB(self):
-        self.train_model(XGBClassifier)
+    def train_XGB(self, cached=True, n_estimators=100, tree_method=None, max_bin=256, n_jobs=None, **params):
+        # cached=True trains XGBBoosterClassifier on a DMatrix that is built once per training matrix and reused
+        # by later calls, e.g. in evaluate_with_params. tree_method None keeps the default of the installed
+        # xgboost. tree_method="hist" is faster on large data and uses a QuantileDMatrix, but its results differ
+        # from the exact and approx methods that xgboost before 2.0 uses by default.
+        # n_jobs None uses model_n_jobs or all cores.
+        # cached=False trains XGBClassifier on the feature matrix like before.
+        params.update(n_estimators=n_estimators, max_bin=max_bin)
+        if tree_method is not None:
+            params["tree_method"] = tree_method
+        if n_jobs is not None:
+            params["n_jobs"] = n_jobs
+        if not cached:
+            self.train_model(XGBClassifier, **params)
+            return
+        dtrain = self._native_matrix(("XGB", tree_method, max_bin),
+                                     lambda X, labels: xgb_training_matrix(X, labels, tree_method, max_bin))
+        self.train_model(XGBBoosterClassifier, dtrain=dtrain, **params)
 
     def train_RarityModel(self, filter_anos=True, threshold=250):
         self.train_model(RarityModel, filter_anos=filter_anos, threshold=threshold)
@@ -206,25 +745,274 @@ class AnomalyDetector:
                 len_col = "e_event_id_len" #item list col has the parser name when using events, but length doesn't
             else:
                 len_col = self.item_list_col+"_len"
-        self.train_model(OOV_detector, filter_anos=filter_anos, len_col=len_col, test_df=self.test_df, threshold=threshold)
+        self.train_model(OOV_detector, filter_anos=filter_anos, len_col=len_col, threshold=threshold)
         
-    def evaluate_all_ads(self, disabled_methods=None):
+    def evaluate_all_ads(self, disabled_methods=None, n_jobs=1, threads_per_job=None):
+        # n_jobs > 1 (or -1 for all cores) trains and predicts the models in parallel processes.
+        # Each process limits the threads of BLAS, OpenMP and models with n_jobs to threads_per_job,
+        # by default the cores divided by n_jobs.
         if disabled_methods is None:
             disabled_methods = set()
-        train_methods = {getattr(self, m) for m in dir(self) if m.startswith('train_') and m not in disabled_methods
-                         and callable(getattr(self, m))}
-        train_methods.discard(self.train_model)
-        for method in train_methods:
-            if not self.print_scores:
-                print(f"Running {method}")
-            time_start = time.process_time()
-            method()
-            self.predict()
-            if self.print_scores:
-                print(f'Total time: {time.process_time()-time_start:.2f} seconds')
+        train_methods = [m for m in dir(self) if m.startswith('train_') and m not in disabled_methods
+                         and m not in _NOT_EVALUATED and callable(getattr(self, m))]
+        if n_jobs != 1:
+            self._evaluate_parallel(train_methods, n_jobs, threads_per_job)
+        else:
+            for method in train_methods:
+                if not self.print_scores:
+                    print(f"Running {method}")
+                time_start = time.process_time()
+                wall_time_start = time.time()
+                _reset_peak_memory()
+                getattr(self, method)()
+                predictions, predictions_proba = self._predict_scores(self._test_matrix())
+                self._report_scores(predictions, predictions_proba, wall_time=time.time() - wall_time_start,
+                                    peak_memory_mb=_peak_memory_mb())
+                if self.print_scores:
+                    print(f'Total time: {time.process_time()-time_start:.2f} seconds')
         if self.print_scores:
             print("---------------------------------------------------------------")
 
+    def _evaluate_parallel(self, train_methods, n_jobs, threads_per_job):
+        from joblib import Parallel, delayed, effective_n_jobs
+        n_jobs = min(effective_n_jobs(n_jobs), len(train_methods))
+        if threads_per_job is None:
+            threads_per_job = max(1, (os.cpu_count() or 1) // max(n_jobs, 1))
+        if self.projection is not None:
+            self._projected_matrices()  # Projected once here and shared with the workers
+        worker_ad = self._worker_copy(self.test_df, threads_per_job)
+        if not self.print_scores:
+            print(f"Running {len(train_methods)} models with {n_jobs} processes and {threads_per_job} threads each")
+        results = Parallel(n_jobs=n_jobs, backend="loky")(
+            delayed(_evaluate_train_method)(worker_ad, method, threads_per_job) for method in train_methods)
+        # Results are reported in the main process in the same order as in sequential runs
+        for model, filter_anos, predictions, predictions_proba, wall_time, peak_memory_mb in results:
+            self.model = model
+            self.filter_anos = filter_anos
+            self.model_projector = self._projector_for(model)
+            self._report_scores(predictions, predictions_proba, wall_time=wall_time, peak_memory_mb=peak_memory_mb)
+            if self.print_scores:
+                print(f'Wall time: {wall_time:.2f} seconds')
+
+    def _worker_copy(self, test_df, threads_per_job):
+        # Workers get a copy without the frames. Joblib memory maps the numpy arrays of the
+        # feature matrices so that all the workers share them instead of getting their own copies.
+        # Scalar columns of the test data are kept for the length columns of OOV_detector, and the sequence
+        # ids for the lengths from the event counts (the event frame goes to the workers with use_event_counts).
+        # Item lists are not sent, their lengths are added as the _len column instead, see _oov_lengths.
+        worker_ad = copy.copy(self)
+        worker_ad.train_df = None
+        len_col = f"{self.item_list_col}_len"
+        if (self.item_list_col in test_df.columns and isinstance(test_df.schema[self.item_list_col], pl.List)
+                and len_col not in test_df.columns):
+            test_df = test_df.with_columns(pl.col(self.item_list_col).list.len().alias(len_col))
+        worker_ad.test_df = test_df.select(
+            [col for col, dtype in test_df.schema.items() if dtype.is_numeric() or dtype == pl.Boolean
+             or col == self.event_seq_col])
+        worker_ad.storage = _ModelResultsStorage()
+        worker_ad.print_scores = False
+        worker_ad.store_scores = False
+        worker_ad._prepared_data = None
+        worker_ad._score_cache = {}
+        worker_ad._native_cache = None  # XGBoost DMatrix can not be pickled, workers build their own
+        worker_ad.model_n_jobs = threads_per_job
+        worker_ad.profile = False  # Records of the worker processes would be lost
+        worker_ad.profile_records = []
+        return worker_ad
+
+    def repeated_splits(self, df, n_repeats=10, test_frac=0.9, split="shuffle", models=None, n_jobs=1,
+                        threads_per_job=None, random_state=None, vectorizer_class=None):
+        # Repeated train/test splits over a matrix that is vectorized only once. split is "shuffle",
+        # "stratified" (same anomaly share in train and test) or "chronological" (last test_frac by
+        # start_time or m_timestamp, the same split every time so it is run only once).
+        # models is a list of model names, e.g. ["LR", "DT"], or a dict of names and parameters like
+        # in evaluate_with_params. By default all models are run. Results go to self.storage.
+        from sklearn.model_selection import ShuffleSplit, StratifiedShuffleSplit
+        labels = df[self.label_col].to_numpy()
+        if split == "chronological":
+            order = self._chronological_order(df)
+            test_size = int(test_frac * df.height)
+            splits = [(order[:df.height - test_size], order[df.height - test_size:])]
+        elif split == "shuffle":
+            splits = ShuffleSplit(n_splits=n_repeats, test_size=test_frac, random_state=random_state).split(labels)
+        elif split == "stratified":
+            splits = StratifiedShuffleSplit(n_splits=n_repeats, test_size=test_frac,
+                                            random_state=random_state).split(labels, labels)
+        else:
+            raise ValueError(f"split must be 'shuffle', 'stratified' or 'chronological', got {split}")
+        self._run_splits(df, splits, models, n_jobs, threads_per_job, vectorizer_class)
+
+    def cross_validate(self, df, n_splits=5, split="shuffle", models=None, n_jobs=1, threads_per_job=None,
+                       random_state=None, vectorizer_class=None):
+        # K-fold cross-validation over a matrix that is vectorized only once. split is "shuffle" (KFold),
+        # "stratified" (StratifiedKFold) or "chronological" (TimeSeriesSplit, training data is always
+        # before the test fold). models as in repeated_splits. Results go to self.storage.
+        from sklearn.model_selection import KFold, StratifiedKFold, TimeSeriesSplit
+        labels = df[self.label_col].to_numpy()
+        if split == "chronological":
+            order = self._chronological_order(df)
+            splits = ((order[train], order[test]) for train, test in TimeSeriesSplit(n_splits=n_splits).split(order))
+        elif split == "shuffle":
+            splits = KFold(n_splits=n_splits, shuffle=True, random_state=random_state).split(labels)
+        elif split == "stratified":
+            splits = StratifiedKFold(n_splits=n_splits, shuffle=True, random_state=random_state).split(labels, labels)
+        else:
+            raise ValueError(f"split must be 'shuffle', 'stratified' or 'chronological', got {split}")
+        self._run_splits(df, splits, models, n_jobs, threads_per_job, vectorizer_class)
+
+    def _split_matrices(self, df, splits, vectorizer_class):
+        # Feature matrices of the splits as (X, n_item_cols, train_idx, test_idx).
+        # Counts and hashes do not depend on the other rows. For them the vocabulary is fitted on all rows once and
+        # each split drops the item columns that do not occur in its training rows, which gives the same matrices
+        # as fitting the vectorizer on the training rows. Other vectorizers, e.g. TfidfVectorizer or min_df, learn
+        # from the rows they see, so they are fitted on the training rows of each split and X is (X_train, X_test).
+        shared = (not self.item_list_col or self.event_seq_col is not None
+                  or isinstance(vectorizer_class, HashingItemVectorizer)
+                  or vectorizer_class in (None, CountVectorizer, ListVectorizer, HashingItemVectorizer))
+        if not shared:
+            for train_idx, test_idx in splits:
+                X_train = self._prepare_features(True, df[train_idx], vectorizer_class)
+                yield (X_train, self._prepare_features(False, df[test_idx])), 0, train_idx, test_idx
+            return
+        X = self._prepare_features(True, df, vectorizer_class)
+        n_item_cols = 0
+        if self.item_list_col:
+            vocabulary = self.vectorizer.vocabulary_
+            n_item_cols = self.vectorizer.n_features if vocabulary is None else len(vocabulary)
+        for train_idx, test_idx in splits:
+            yield X, n_item_cols, train_idx, test_idx
+
+    @staticmethod
+    def _chronological_order(df):
+        for time_col in ["start_time", "m_timestamp"]:
+            if time_col in df.columns:
+                return df[time_col].arg_sort().to_numpy()
+        raise ValueError("Chronological split needs a start_time or m_timestamp column")
+
+    def _run_splits(self, df, splits, models, n_jobs, threads_per_job, vectorizer_class):
+        if models is None:
+            models = {m[len("train_"):]: {} for m in dir(self) if m.startswith("train_") and m not in _NOT_EVALUATED
+                      and callable(getattr(self, m))}
+        elif not isinstance(models, dict):
+            models = {name: {} for name in models}
+        splits = list(splits)
+        split_ad = copy.copy(self)  # Keeps the vectorizer of the current model
+        labels = df[self.label_col].to_numpy()
+        if n_jobs == 1:
+            worker_ad = split_ad._worker_copy(df, None)
+            results = [_evaluate_split(worker_ad, X, n_item_cols, labels, train_idx, test_idx, models, None)
+                       for X, n_item_cols, train_idx, test_idx
+                       in split_ad._split_matrices(df, splits, vectorizer_class)]
+        else:
+            from joblib import Parallel, delayed, effective_n_jobs
+            n_jobs = min(effective_n_jobs(n_jobs), len(splits))
+            if threads_per_job is None:
+                threads_per_job = max(1, (os.cpu_count() or 1) // max(n_jobs, 1))
+            worker_ad = split_ad._worker_copy(df, threads_per_job)
+            results = Parallel(n_jobs=n_jobs, backend="loky")(
+                delayed(_evaluate_split)(worker_ad, X, n_item_cols, labels, train_idx, test_idx, models,
+                                         threads_per_job)
+                for X, n_item_cols, train_idx, test_idx in split_ad._split_matrices(df, splits, vectorizer_class))
+        for split_index, split_results in enumerate(results):
+            if not self.print_scores:
+                print(f"Split {split_index + 1}/{len(results)} done")
+            for model, labels_test, predictions, predictions_proba, wall_time, peak_memory_mb, projection in split_results:
+                if self.print_scores:
+                    self._print_evaluation_scores(labels_test, predictions, predictions_proba, model, auc_roc=False)
+                self.storage.store_test_results(labels_test, predictions, predictions_proba, _model_name(model),
+                                                self.item_list_col, self.numeric_cols, self.emb_list_col,
+                                                wall_time=wall_time, peak_memory_mb=peak_memory_mb,
+                                                split_index=split_index, projection=projection)
+
+    @staticmethod
+    def frame_batches(source, batch_rows=100000, columns=None):
+        # Yields row batches of a DataFrame, LazyFrame or Parquet file for train_incremental and
+        # evaluate_incremental. Files are scanned lazily so only one batch is read into memory at a time.
+        # Enhance the batches with a generator, e.g. (enhance(df) for df in AnomalyDetector.frame_batches(path)).
+        if isinstance(source, pl.DataFrame):
+            source = source.lazy()
+        elif isinstance(source, (str, os.PathLike)):
+            source = pl.scan_parquet(source)
+        if columns:
+            source = source.select(columns)
+        offset = 0
+        while True:
+            df = source.slice(offset, batch_rows).collect()
+            if df.height == 0:
+                return
+            yield df
+            offset += df.height
+
+    def train_incremental(self, batches, model="SGD", vectorizer=None, n_features=2**18, filter_anos=None,
+                          **model_kwargs):
+        # Out-of-core training from an iterable of frames, e.g. from frame_batches. Each batch is vectorized and
+        # given to partial_fit of the model, so memory is bounded by the batch size and not the data size.
+        # model is "SGD", "PassiveAggressive", "MiniBatchKMeans", "RarityModel" or a class with partial_fit.
+        # Items are vectorized with vectorizer, a vectorizer fitted e.g. on a sample to fix the vocabulary,
+        # or by default hashed to n_features columns. Supervised models should get shuffled batches.
+        if self.event_seq_col is not None:
+            # Event counts need a vocabulary fitted on the whole event frame, and batches carry no events
+            raise ValueError("train_incremental does not support use_event_counts. Give the batches with an "
+                             "item list column, e.g. from SequenceEnhancer.events, and set item_list_col.")
+        if isinstance(model, str):
+            if model not in _INCREMENTAL_MODELS:
+                raise ValueError(f"model must be one of {list(_INCREMENTAL_MODELS)} or a class, got {model}")
+            model, defaults, default_filter_anos = _INCREMENTAL_MODELS[model]
+            model_kwargs = {**defaults, **model_kwargs}
+        else:
+            default_filter_anos = False
+        self.model = model(**model_kwargs)
+        self.filter_anos = default_filter_anos if filter_anos is None else filter_anos
+        self._calibrated_svc = None
+        self._score_cache = {}
+        self.model_projector = None
+        # Classifiers need all the classes in the first partial_fit call
+        supervised = "classes" in inspect.signature(self.model.partial_fit).parameters
+        self.vectorizer = vectorizer
+        for df in batches:
+            if self.item_list_col and self.vectorizer is None:
+                # Stateless, the columns are the same for every batch
+                self.vectorizer = HashingItemVectorizer(n_features=n_features)
+            X = self._prepare_features(False, df)
+            labels = df[self.label_col].to_numpy().astype(bool)
+            if self.filter_anos:
+                X, labels = X[~labels], labels[~labels]
+            if X.shape[0] == 0:
+                continue
+            if supervised:
+                self.model.partial_fit(X, labels, classes=np.array([False, True]))
+            else:
+                self.model.partial_fit(X)
+        self.train_vocabulary = getattr(self.vectorizer, "vocabulary_", None)
+
+    def evaluate_incremental(self, batches):
+        # Batched prediction of the current model over an iterable of labelled frames. Only the labels and
+        # scores are kept. Scores are printed and stored like in predict and returned as a Polars DataFrame.
+        labels, predictions, predictions_proba = [], [], []
+        time_start = time.time()
+        for df in batches:
+            X = self._prepare_features(False, df)
+            if self.model_projector is not None:
+                X = self.model_projector.transform(X)
+            batch_predictions, batch_proba = self._predict_scores(X, df)
+            labels.append(df[self.label_col].to_numpy().astype(bool))
+            predictions.append(np.asarray(batch_predictions))
+            if batch_proba is not None:
+                predictions_proba.append(np.asarray(batch_proba, dtype=np.float32))
+        wall_time = time.time() - time_start
+        labels, predictions = np.concatenate(labels), np.concatenate(predictions)
+        predictions_proba = np.concatenate(predictions_proba) if predictions_proba else None
+        if self.print_scores:
+            self._print_evaluation_scores(labels, predictions, predictions_proba, self.model, auc_roc=False)
+        if self.store_scores:
+            self.storage.store_test_results(labels, predictions, predictions_proba, _model_name(self.model),
+                                            self.item_list_col, self.numeric_cols, self.emb_list_col,
+                                            wall_time=wall_time)
+        df_scores = pl.DataFrame({self.label_col: labels, "pred_ano": predictions})
+        if predictions_proba is not None:
+            df_scores = df_scores.with_columns(pl.Series(name="pred_ano_proba", values=predictions_proba))
+        return df_scores
+
     def evaluate_with_params(self, models_dict):
         for func_name, params in models_dict.items():
             func_name = "train_"+func_name
@@ -232,8 +1020,75 @@ class AnomalyDetector:
             method(**params)
             self.predict()
 
+    def save(self, path):
+        # Saves the fitted vectorizer, model and predictor settings to a bundle directory. The training
+        # data is not saved. Load with AnomalyDetector.load(path) and predict with score(df).
+        import json
+        import joblib
+        import sklearn
+        from . import __version__
+        if not hasattr(self, "model"):
+            raise ValueError("No trained model to save. Train a model first.")
+        os.makedirs(path, exist_ok=True)
+        manifest = {
+            "format_version": _BUNDLE_FORMAT_VERSION,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "model": type(self.model).__name__,
+            "item_list_col": self.item_list_col,
+            "numeric_cols": list(self.numeric_cols),
+            "emb_list_col": self.emb_list_col,
+            "label_col": self.label_col,
+            "filter_anos": self.filter_anos,
+            "auc_roc": self.auc_roc,
+            "threshold": getattr(self.model, "threshold", None),
+            "projection": self.projection if self.model_projector is not None else None,
+            "event_seq_col": self.event_seq_col,
+            "versions": {"loglead": __version__, "sklearn": sklearn.__version__, "polars": pl.__version__,
+                         "numpy": np.__version__},
+        }
+        # Calibration needs the training data, so it is done before saving
+        calibrated_model = self._calibrated_model() if isinstance(self.model, LinearSVC) and self.auc_roc else None
+        state = {"vectorizer": getattr(self, "vectorizer", None), "model": self.model, "calibrated_model": calibrated_model,
+                 "train_vocabulary": self.train_vocabulary, "model_n_jobs": self.model_n_jobs,
+                 "projector": self.model_projector}
+        joblib.dump(state, os.path.join(path, "detector.joblib"))
+        with open(os.path.join(path, "manifest.json"), "w") as f:
+            json.dump(manifest, f, indent=2, default=str)
+
+    @classmethod
+    def load(cls, path, print_scores=False):
+        import json
+        import joblib
+        import sklearn
+        with open(os.path.join(path, "manifest.json")) as f:
+            manifest = json.load(f)
+        if manifest.get("format_version", 0) > _BUNDLE_FORMAT_VERSION:
+            raise ValueError(f"Bundle {path} has format version {manifest['format_version']}, "
+                             f"this LogLead supports up to {_BUNDLE_FORMAT_VERSION}")
+        if manifest["versions"]["sklearn"] != sklearn.__version__:
+            print(f"WARNING! Bundle {path} was saved with scikit-learn {manifest['versions']['sklearn']}, "
+                  f"running {sklearn.__version__}. Predictions may differ.")
+        state = joblib.load(os.path.join(path, "detector.joblib"))
+        ad = cls(item_list_col=manifest["item_list_col"], numeric_cols=manifest["numeric_cols"],
+                 emb_list_col=manifest["emb_list_col"], label_col=manifest["label_col"],
+                 print_scores=print_scores, auc_roc=manifest["auc_roc"])
+        if state["vectorizer"] is not None:
+            ad.vectorizer = state["vectorizer"]
+        ad.model = state["model"]
+        if state.get("calibrated_model") is not None:
+            ad._calibrated_svc = (ad.model, state["calibrated_model"])
+        ad.filter_anos = manifest["filter_anos"]
+        ad.train_vocabulary = state["train_vocabulary"]
+        ad.model_n_jobs = state["model_n_jobs"]
+        ad.model_projector = state.get("projector")
+        ad.projection = manifest.get("projection")
+        ad.event_seq_col = manifest.get("event_seq_col")
+        ad.X_train = None
+        ad.manifest = manifest
+        return ad
+
     def _print_evaluation_scores(self, y_test, y_pred, y_pred_proba, model, f_importance=False, auc_roc=True):
-        print(f"Results from model: {type(model).__name__}")
+        print(f"Results from model: {_model_name(model)}")
         # Evaluate the model's performance
         accuracy = accuracy_score(y_test, y_pred)
         print(f"Accuracy: {accuracy:.4f}")
@@ -276,17 +1131,52 @@ class AnomalyDetector:
                 
         #AUC-ROC analysis for selected unsupervised models
         if auc_roc:      
-            titlestr = type(self.model).__name__ + " ROC"
-            X_test_to_use = self.X_test_no_anos if self.filter_anos else self.X_test
+            titlestr = _model_name(self.model) + " ROC"
+            X_test_to_use = self._test_matrix()
+            # Continuous scores from prediction differ only by a constant (IsolationForest offset) or are
+            # the same (KMeans distances), so they are reused when available
             if isinstance(self.model, IsolationForest):
-                y_pred = 1 - model.score_samples(X_test_to_use) #lower = anomalous
+                y_pred = 1 - model.score_samples(X_test_to_use) if y_pred_proba is None else y_pred_proba #lower = anomalous
                 print(f"AUCROC: {self._auc_roc_analysis(y_test, y_pred, titlestr):.4f}")
-            if isinstance(self.model, KMeans):
-                y_pred = np.min(model.transform(X_test_to_use), axis=1) #Shortest distance from the cluster to be used as ano score
+            if isinstance(self.model, (KMeans, MiniBatchKMeans)):
+                #Shortest distance from the cluster to be used as ano score
+                y_pred = np.min(model.transform(X_test_to_use), axis=1) if y_pred_proba is None else y_pred_proba
                 print(f"AUCROC: {self._auc_roc_analysis(y_test, y_pred, titlestr):.4f}")
             if isinstance(self.model, (RarityModel, OOV_detector)):
                 print(f"AUCROC: {self._auc_roc_analysis(y_test, model.scores, titlestr):.4f}")
 
+    @staticmethod
+    def threshold_sweep(labels, scores):
+        # Precision, recall and F1 at every threshold of continuous scores, e.g. pred_ano_proba, RarityModel.scores
+        # or decision_function values where higher is more anomalous. Items with score >= threshold are anomalies.
+        # Computed in one pass over the sorted scores. Returns the best F1 point as a dict and the curve as a
+        # Polars DataFrame. Stored results have the best threshold of their scores, see storage.results_df.
+        labels = np.asarray(labels).astype(bool)
+        scores = np.asarray(scores, dtype=np.float64)
+        if labels.shape != scores.shape or labels.ndim != 1:
+            raise ValueError(f"labels and scores should be 1D and of the same length, got {labels.shape} and {scores.shape}")
+        if len(scores) == 0 or np.isnan(scores).any():
+            raise ValueError("scores should not be empty or contain NaN")
+        order = np.argsort(-scores, kind="stable")
+        sorted_scores = scores[order]
+        tp = np.cumsum(labels[order])
+        fp = np.arange(1, len(scores) + 1) - tp
+        # Equal scores are always on the same side of the threshold, so take the last position of each score
+        last = np.append(np.flatnonzero(np.diff(sorted_scores)), len(scores) - 1)
+        tp, fp = tp[last], fp[last]
+        positives = tp[-1]
+        curve = pl.DataFrame({
+            "threshold": sorted_scores[last],
+            "tp": tp,
+            "fp": fp,
+            "precision": tp / (tp + fp),
+            "recall": tp / positives if positives else np.zeros(len(tp)),
+            "f1": 2 * tp / (tp + fp + positives),
+        })
+        # First maximum is the highest threshold, i.e. the fewest flagged items
+        best = curve.row(int(np.argmax(curve["f1"].to_numpy())), named=True)
+        return best, curve
+
     @staticmethod
     def _auc_roc_analysis(labels, preds, titlestr ="ROC", plot=False):
         # Compute the ROC curve
@@ -311,9 +1201,116 @@ class AnomalyDetector:
         return roc_auc
 
 
+def _make_projector(method, n_components, n_cols):
+    # Projection is only used when it reduces the number of columns
+    if method not in ("svd", "random", "hashing"):
+        raise ValueError(f"projection must be 'svd', 'random', 'hashing' or None, got {method}")
+    if n_cols <= n_components:
+        return None
+    if method == "svd":
+        from sklearn.decomposition import TruncatedSVD
+        return TruncatedSVD(n_components=n_components)
+    if method == "random":
+        from sklearn.random_projection import SparseRandomProjection
+        return SparseRandomProjection(n_components=n_components, dense_output=True)
+    return ColumnHasher(n_features=n_components)
+
+
+def _model_name(model):
+    # Name of the model in stored results, prints and profiles. Wrappers keep the name of the model they replace.
+    return getattr(model, "result_name", type(model).__name__)
+
+
+def _identity_analyzer(items):
+    # Module level function instead of a lambda so that fitted vectorizers can be pickled
+    return items
+
+
+def _reset_peak_memory():
+    # Linux can reset the peak resident memory of the process so that it can be measured per model
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def _peak_memory_mb():
+    # Peak resident memory of the current process since _reset_peak_memory, where supported
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # Peak of the whole process lifetime. Not available on Windows.
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes on Linux
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+
+def _evaluate_train_method(ad, method, threads):
+    # Runs in a worker process of AnomalyDetector.evaluate_all_ads
+    from threadpoolctl import threadpool_limits
+    with threadpool_limits(limits=threads):
+        _reset_peak_memory()
+        time_start = time.time()
+        getattr(ad, method)()
+        predictions, predictions_proba = ad._predict_scores(ad._test_matrix())
+        wall_time = time.time() - time_start
+    return ad.model, ad.filter_anos, predictions, predictions_proba, wall_time, _peak_memory_mb()
+
+
+def _evaluate_split(ad, X, n_item_cols, labels, train_idx, test_idx, models, threads):
+    # Trains and predicts the models of one split of AnomalyDetector.repeated_splits or cross_validate.
+    # Runs in the calling process or in a worker process.
+    from threadpoolctl import threadpool_limits
+    if isinstance(X, tuple):
+        X_train, X_test = X  # Vectorizer fitted on the training rows of this split
+    else:
+        X_train, X_test = X[train_idx], X[test_idx]
+    if n_item_cols:
+        # Keep the items seen in training and all the dense feature columns after them
+        keep = np.ones(X.shape[1], dtype=bool)
+        keep[:n_item_cols] = np.asarray(X_train[:, :n_item_cols].sum(axis=0)).ravel() > 0
+        X_train, X_test = X_train[:, keep], X_test[:, keep]
+    ad.X_train, ad.labels_train = X_train, labels[train_idx].tolist()
+    ad.X_test, ad.labels_test = X_test, labels[test_idx].tolist()
+    normal_rows = ~labels[train_idx].astype(bool)
+    ad.X_train_no_anos, ad.labels_train_no_anos = X_train[normal_rows], labels[train_idx][normal_rows].tolist()
+    ad.X_test_no_anos, ad.labels_test_no_anos = ad.X_test, ad.labels_test
+    test_df = ad.test_df
+    results = []
+    with threadpool_limits(limits=threads):
+        for name, params in models.items():
+            ad.test_df = test_df[test_idx]
+            _reset_peak_memory()
+            time_start = time.time()
+            getattr(ad, "train_" + name)(**params)
+            predictions, predictions_proba = ad._predict_scores(ad._test_matrix())
+            results.append((ad.model, ad.labels_test, predictions, predictions_proba, time.time() - time_start,
+                            _peak_memory_mb(), ad.projection if ad.model_projector is not None else None))
+    ad.test_df = test_df
+    return results
+
+
 class _ModelResultsStorage:
+    # Labels and predictions of each run are kept as NumPy arrays (bool labels and predictions, float32
+    # scores). Metrics and the confusion matrix are computed once when a result is stored and collected
+    # to a Polars frame, see results_df, which the tables and prints use.
+    _UNSUPERVISED = ["KMeans", "IsolationForest", "OneClassSVM", "LocalOutlierFactor", "OOV_detector", "RarityModel",
+                     "MiniBatchKMeans", "SubsampledLOF", "NystroemOneClassSVM"]
+    # Table column and results_df column of each score_type
+    _SCORE_COLUMNS = {"accuracy": ("Accuracy", "accuracy"), "f1": ("F1 Score", "f1"), "auc-roc": ("AUC-ROC", "auc_roc")}
+
     def __init__(self):
         self.test_results = []
+        self._results_df = None  # Frame of the metrics of test_results, built on first use after a store
 
     def _create_input_signature(self, item_list_col, numeric_cols, emb_list_col):
         # Create the input signature by concatenating all input types
@@ -325,100 +1322,153 @@ class _ModelResultsStorage:
         input_signature = ''.join(str(item) for sublist in input_parts for item in sublist)
         return input_signature
 
-    def store_test_results(self, y_test, y_pred, y_pred_proba, model_name, item_list_col=None, numeric_cols=None, emb_list_col=None):
+    def store_test_results(self, y_test, y_pred, y_pred_proba, model_name, item_list_col=None, numeric_cols=None, emb_list_col=None,
+                           wall_time=None, peak_memory_mb=None, split_index=None, projection=None):
         input_signature = self._create_input_signature(item_list_col, numeric_cols, emb_list_col)
-
+        y_test = np.asarray(y_test).astype(bool)
+        y_pred = np.asarray(y_pred).astype(bool)
+        tp = np.count_nonzero(y_test & y_pred)
+        fp = np.count_nonzero(~y_test & y_pred)
+        fn = np.count_nonzero(y_test & ~y_pred)
+        tn = len(y_test) - tp - fp - fn
+        aucroc = 0
+        best = {"threshold": None, "f1": None}
+        if y_pred_proba is not None:
+            # AUC and the best threshold from the full precision scores, float32 could tie close scores.
+            # Both are undefined e.g. for a single class test set or NaN scores, then stored as None.
+            try:
+                aucroc = roc_auc_score(y_test, y_pred_proba)
+            except ValueError:
+                aucroc = None
+            if aucroc is not None and np.isnan(aucroc):  # Newer scikit-learn warns and gives NaN instead
+                aucroc = None
+            try:
+                best, _ = AnomalyDetector.threshold_sweep(y_test, y_pred_proba)
+            except ValueError:
+                pass
+            y_pred_proba = np.asarray(y_pred_proba, dtype=np.float32)
         result = {
-            #'model': model,
-            'model':model_name,
+            'model': model_name,
             'y_test': y_test,
             'y_pred': y_pred,
             'y_pred_proba': y_pred_proba,
             'input_signature': input_signature,
+            'accuracy': (tp + tn) / len(y_test) if len(y_test) else 0.0,
+            'f1': 2 * tp / (2 * tp + fp + fn) if tp + fp + fn else 0.0,  # 0 when undefined like in f1_score
+            'auc_roc': aucroc,
+            'confusion_matrix': np.array([[tn, fp], [fn, tp]]),
+            'best_threshold': best['threshold'],  # Score threshold of the best F1, see AnomalyDetector.threshold_sweep
+            'best_f1': best['f1'],
+            'wall_time': wall_time,  # Training and prediction time in seconds
+            'peak_memory_mb': peak_memory_mb,  # Peak memory of the process that ran the model
+            'split_index': split_index,  # Split of repeated_splits or cross_validate
+            'projection': projection,  # Projection stage of the model input, None for the raw matrix
         }
         self.test_results.append(result)
+        self._results_df = None
 
-    def calculate_average_scores(self, score_type='accuracy', metric='mean', mark_model_supervision = True):
-        if score_type not in ['accuracy', 'f1', 'auc-roc']:
-            raise ValueError("score_type must be 'accuracy', 'f1', 'auc-roc'.")
-        #if metric not in ['mean', 'median']:
-        #    raise ValueError("metric must be 'mean' or 'median'.")
-        # Create a list to store each row of the DataFrame
-        data_for_df = []
+    @property
+    def results_df(self):
+        # One row of metrics per stored result
+        if self._results_df is None:
+            self._results_df = pl.DataFrame({
+                "model": [r['model'] for r in self.test_results],
+                "input_signature": [r['input_signature'] for r in self.test_results],
+                "projection": [r['projection'] for r in self.test_results],
+                "split_index": [r['split_index'] for r in self.test_results],
+                "accuracy": [float(r['accuracy']) for r in self.test_results],
+                "f1": [float(r['f1']) for r in self.test_results],
+                "auc_roc": [r['auc_roc'] for r in self.test_results],
+                "tn": [int(r['confusion_matrix'][0, 0]) for r in self.test_results],
+                "fp": [int(r['confusion_matrix'][0, 1]) for r in self.test_results],
+                "fn": [int(r['confusion_matrix'][1, 0]) for r in self.test_results],
+                "tp": [int(r['confusion_matrix'][1, 1]) for r in self.test_results],
+                "best_threshold": [r.get('best_threshold') for r in self.test_results],
+                "best_f1": [r.get('best_f1') for r in self.test_results],
+                "wall_time": [r['wall_time'] for r in self.test_results],
+                "peak_memory_mb": [r['peak_memory_mb'] for r in self.test_results],
+            }, schema={"model": pl.Utf8, "input_signature": pl.Utf8, "projection": pl.Utf8, "split_index": pl.Int64,
+                       "accuracy": pl.Float64, "f1": pl.Float64, "auc_roc": pl.Float64, "tn": pl.Int64,
+                       "fp": pl.Int64, "fn": pl.Int64, "tp": pl.Int64, "best_threshold": pl.Float64,
+                       "best_f1": pl.Float64, "wall_time": pl.Float64,
+                       "peak_memory_mb": pl.Float64})
+        return self._results_df
 
-        # Iterate over stored results and calculate scores
-        for result in self.test_results:
-            #model_name = type(result['model']).__name__
-            model_name = result['model']
-            if mark_model_supervision:
-                unsupervised = ["KMeans", "IsolationForest", "OneClassSVM", "LocalOutlierFactor", "OOV_detector", "RarityModel"]
-                if model_name in unsupervised:
-                    model_name = "us-"+model_name
-                else:
-                    model_name = "su-"+model_name
-            input_signature = result['input_signature']
-            
-            # Calculate scores
-            acc = accuracy_score(result['y_test'], result['y_pred'])
-            f1 = f1_score(result['y_test'], result['y_pred'])
-#            auc-roc = roc_auc_score(result['y_test'], result['y_pred_proba'])
-            if 'y_pred_proba' in result and result['y_test'] is not None and result['y_pred_proba'] is not None:
-                aucroc = roc_auc_score(result['y_test'], result['y_pred_proba'])
-            else:
-                aucroc = 0  # 
-            # Append row to the list
-            data_for_df.append({
-                'Model': model_name,
-                'Input Signature': input_signature,
-                'Accuracy': acc,
-                'F1 Score': f1,
-                'AUC-ROC': aucroc
+    def write_parquet(self, path, predictions=True):
+        # Saves the results for later aggregation. With predictions=False only the metrics are saved.
+        df = self.results_df
+        if predictions:
+            df = df.with_columns(
+                self._list_series("y_test", pl.Boolean),
+                self._list_series("y_pred", pl.Boolean),
+                self._list_series("y_pred_proba", pl.Float32),
+            )
+        df.write_parquet(path)
+
+    def _list_series(self, name, dtype):
+        # One list per result, results without the arrays (e.g. no scores) are null
+        return pl.concat([pl.Series(name, [r[name]], dtype=pl.List(dtype)) for r in self.test_results]) \
+            if self.test_results else pl.Series(name, [], dtype=pl.List(dtype))
+
+    def read_parquet(self, path):
+        # Adds the results of write_parquet files, path can be a glob, e.g. "results/*.parquet"
+        df = pl.read_parquet(path)
+        for row in df.iter_rows(named=True):
+            self.test_results.append({
+                'model': row['model'],
+                'y_test': np.array(row['y_test'], dtype=bool) if row.get('y_test') is not None else None,
+                'y_pred': np.array(row['y_pred'], dtype=bool) if row.get('y_pred') is not None else None,
+                'y_pred_proba': np.array(row['y_pred_proba'], dtype=np.float32)
+                                if row.get('y_pred_proba') is not None else None,
+                'input_signature': row['input_signature'],
+                'accuracy': row['accuracy'],
+                'f1': row['f1'],
+                'auc_roc': row['auc_roc'],
+                'confusion_matrix': np.array([[row['tn'], row['fp']], [row['fn'], row['tp']]]),
+                'best_threshold': row.get('best_threshold'),
+                'best_f1': row.get('best_f1'),
+                'wall_time': row['wall_time'],
+                'peak_memory_mb': row['peak_memory_mb'],
+                'split_index': row['split_index'],
+                'projection': row['projection'],
             })
+        self._results_df = None
 
-        # Convert the list to a DataFrame
-        df = pd.DataFrame(data_for_df)
-
-        #  # Calculate average scores
-        # if score_type == 'accuracy':
-        #     df_average = df.groupby(['Model', 'Input Signature']).agg({'Accuracy': 'mean'}).reset_index()
-        # elif  score_type == 'f1':
-        #     df_average = df.groupby(['Model', 'Input Signature']).agg({'F1 Score': 'mean'}).reset_index()
-        # else:
-        #     df_average = df.groupby(['Model', 'Input Signature']).agg({'AUC-ROC': 'mean'}).reset_index()
-        # Calculate average scores
-        if score_type == 'accuracy':
-            score_column = 'Accuracy'
-        elif score_type == 'f1':
-            score_column = 'F1 Score'
-        else:
-            score_column = 'AUC-ROC'
-        
-        df_average = df.groupby(['Model', 'Input Signature']).agg({score_column: metric}).reset_index()
-
-        # # Pivot the DataFrame to get Input Signatures as columns
-        score_column = 'Accuracy' if score_type == 'accuracy' else 'F1 Score' if score_type == 'f1' else 'AUC-ROC'
-#        df_pivot = df_average.pivot(index='Model', columns='Input Signature', values=score_column).reset_index()
-        df_pivot = df_average.pivot(index='Model', columns='Input Signature', values=score_column)
-        df_pivot.columns = df_pivot.columns.map(lambda x: x.replace('_', '-'))
-        # Fill NaN values with 0 or an appropriate value
-        df_pivot.fillna(0, inplace=True)  # fill NaN values with 0
-
-        df_pivot = df_pivot.apply(pd.to_numeric, errors='coerce')
-        # Calculate and add column averages at the bottom of the DataFrame
-        df_pivot.loc['Column Average'] = df_pivot.mean(numeric_only=True)
-
-        # Calculate and add row averages as a new column
-        df_pivot['Row Average'] = df_pivot.mean(axis=1, numeric_only=True)
-        
-        df_pivot = df_pivot.map(lambda x: f"{x:.3f}")
+    def calculate_average_scores(self, score_type='accuracy', metric='mean', mark_model_supervision = True):
+        if score_type not in ['accuracy', 'f1', 'auc-roc']:
+            raise ValueError("score_type must be 'accuracy', 'f1', 'auc-roc'.")
+        if not hasattr(pl.Expr, metric):
+            raise ValueError(f"metric must be an aggregation like 'mean', 'median', 'min' or 'max', got {metric}")
+        score_column, metric_column = self._SCORE_COLUMNS[score_type]
+        model_name = pl.col("model")
+        if mark_model_supervision:
+            model_name = pl.when(pl.col("model").is_in(self._UNSUPERVISED)).then(pl.lit("us-")) \
+                .otherwise(pl.lit("su-")) + pl.col("model")
+        model_name = pl.when(pl.col("projection").is_not_null()) \
+            .then(model_name + pl.lit("-") + pl.col("projection")).otherwise(model_name)
+        df = self.results_df.select(
+            model_name.alias("Model"),
+            pl.col("input_signature").str.replace_all("_", "-").alias("Input Signature"),
+            pl.col(metric_column).alias(score_column),
+        )
+        df_average = df.group_by(["Model", "Input Signature"]).agg(getattr(pl.col(score_column), metric)())
+        df_pivot = df_average.pivot(values=score_column, index="Model", columns="Input Signature").sort("Model")
+        signatures = sorted(df_pivot.columns[1:])
+        # Fill missing values with 0 and add column averages at the bottom and row averages to the right
+        df_pivot = df_pivot.select("Model", *[pl.col(col).cast(pl.Float64).fill_null(0) for col in signatures])
+        df_pivot = pl.concat([df_pivot, df_pivot.select(pl.lit("Column Average").alias("Model"),
+                                                        *[pl.col(col).mean() for col in signatures])])
+        df_pivot = df_pivot.with_columns(pl.mean_horizontal(signatures).alias("Row Average"))
+        # Pandas with formatted strings for to_csv and to_latex
+        df_pivot = df_pivot.with_columns(pl.exclude("Model").map_elements(lambda x: f"{x:.3f}", return_dtype=pl.Utf8))
+        df_pivot = df_pivot.to_pandas().set_index("Model")
+        df_pivot.columns.name = "Input Signature"
         return df_pivot
-        
+
     def print_confusion_matrices(self, model_filter=None, signature_filter=None):
         for result in self.test_results:
-            #model_name = type(result['model']).__name__
             model_name = result['model']
             input_signature = result['input_signature']
-            cm = confusion_matrix(result['y_test'], result['y_pred'])
 
             # Check if model_name matches model_filter, if provided
             if model_filter and model_name != model_filter:
@@ -431,7 +1481,7 @@ class _ModelResultsStorage:
             print(f"Model: {model_name}")
             print(f"Input Signature: {input_signature}")
             print("Confusion Matrix:")
-            print(cm)
+            print(result['confusion_matrix'])
             
     def print_scores(self, model_filter=None, signature_filter=None, score_type='all'):
         # Check for valid score_type
@@ -440,11 +1490,8 @@ class _ModelResultsStorage:
             raise ValueError(f"score_type must be one of {valid_score_types}")
 
         for result in self.test_results:
-            #model_name = type(result['model']).__name__
             model_name = result['model']
             input_signature = result['input_signature']
-            acc = accuracy_score(result['y_test'], result['y_pred'])
-            f1 = f1_score(result['y_test'], result['y_pred'])
 
             # Filter results
             if model_filter and model_name != model_filter:
@@ -456,8 +1503,6 @@ class _ModelResultsStorage:
             print(f"Model: {model_name}")
             print(f"Input Signature: {input_signature}")
             if score_type in ['accuracy', 'all']:
-                print(f"Accuracy: {acc:.4f}")
+                print(f"Accuracy: {result['accuracy']:.4f}")
             if score_type in ['f1', 'all']:
-                print(f"F1 Score: {f1:.4f}")
-
-
+                print(f"F1 Score: {result['f1']:.4f}")
@@ -0,0 +1,77 @@
+import numpy as np
+
+__all__ = ['XGBBoosterClassifier']
+
+
+class XGBBoosterClassifier:
+    """ Binary XGBoost classifier trained with xgboost.train on a DMatrix that AnomalyDetector builds once per
+        training matrix and reuses, see AnomalyDetector.train_XGB. Without dtrain the DMatrix is built in fit.
+        Prediction uses inplace_predict on the sparse or dense matrix, so no DMatrix is built for test data.
+        Defaults are the same as in XGBClassifier, e.g. tree_method None leaves the choice to xgboost, and
+        results are stored and printed as XGBClassifier.
+    """
+    result_name = "XGBClassifier"
+
+    def __init__(self, n_estimators=100, tree_method=None, max_bin=256, n_jobs=None, dtrain=None, **params):
+        self.n_estimators = n_estimators
+        self.tree_method = tree_method
+        self.max_bin = max_bin
+        self.n_jobs = n_jobs
+        self.dtrain = dtrain
+        self.params = params
+        self.booster_ = None
+
+    def get_params(self, deep=True):
+        return {"n_estimators": self.n_estimators, "tree_method": self.tree_method, "max_bin": self.max_bin,
+                "n_jobs": self.n_jobs, "dtrain": self.dtrain, **self.params}
+
+    def set_params(self, **params):
+        for key, value in params.items():
+            if key in ("n_estimators", "tree_method", "max_bin", "n_jobs", "dtrain"):
+                setattr(self, key, value)
+            else:
+                self.params[key] = value
+        return self
+
+    def fit(self, X, labels=None):
+        import xgboost as xgb
+        dtrain = self.dtrain
+        if dtrain is None:
+            dtrain = xgb_training_matrix(X, labels, self.tree_method, self.max_bin)
+        params = {"objective": "binary:logistic", "max_bin": self.max_bin, **self.params}
+        if self.tree_method is not None:
+            params["tree_method"] = self.tree_method
+        if self.n_jobs is not None:
+            params["nthread"] = self.n_jobs
+        self.booster_ = xgb.train(params, dtrain, num_boost_round=self.n_estimators)
+        # The DMatrix stays in the AnomalyDetector cache, it is not part of the fitted model and can not be saved
+        self.dtrain = None
+        return self
+
+    def predict_proba(self, X):
+        if self.booster_ is None:
+            raise ValueError("XGBBoosterClassifier is not fitted. Call fit first.")
+        proba = self.booster_.inplace_predict(X)
+        return np.column_stack([1 - proba, proba])
+
+    def predict(self, X):
+        return (self.predict_proba(X)[:, 1] > 0.5).astype(int)
+
+    @property
+    def feature_importances_(self):
+        # Total gain of each feature normalized to sum to 1, features of the matrix are named f0, f1, ...
+        scores = self.booster_.get_score(importance_type="total_gain")
+        importances = np.zeros(self.booster_.num_features())
+        for name, value in scores.items():
+            importances[int(name[1:])] = value
+        total = importances.sum()
+        return importances / total if total > 0 else importances
+
+
+def xgb_training_matrix(X, labels, tree_method=None, max_bin=256):
+    # QuantileDMatrix for the hist method, it quantizes the data without a float copy of the whole matrix
+    import xgboost as xgb
+    labels = np.asarray(labels, dtype=np.float32)
+    if tree_method == "hist":
+        return xgb.QuantileDMatrix(X, label=labels, max_bin=max_bin)
+    return xgb.DMatrix(X, label=labels)
@@ -0,0 +1,50 @@
+import numpy as np
+
+__all__ = ['CascadeDetector']
+
+
+class CascadeDetector:
+    """ Cheap anomaly scorer in front of an expensive model. Items with a cheap score below threshold are
+        predicted normal without running the expensive model, the rest are forwarded to it. The threshold is
+        the highest one that still forwards target_recall of the training anomalies (the recall guard).
+        The cheap scorer is a fitted OOV_detector or RarityModel, or the name of a score column where higher
+        is more anomalous, e.g. nep_prob_nmax_perp. AnomalyDetector.train_cascade builds and uses it.
+    """
+    def __init__(self, cheap, expensive, target_recall=0.99, expensive_projector=None):
+        if not 0 < target_recall <= 1:
+            raise ValueError(f"target_recall must be in (0, 1], got {target_recall}")
+        self.cheap = cheap
+        self.expensive = expensive
+        self.target_recall = target_recall
+        self.expensive_projector = expensive_projector  # Projection of the expensive model input, if any
+        self.threshold = None
+        self.train_forwarded_frac = None  # Share of training items that would be forwarded
+
+    def calibrate(self, cheap_scores, labels):
+        cheap_scores = self._clean(cheap_scores)
+        labels = np.asarray(labels).astype(bool)
+        ano_scores = np.sort(cheap_scores[labels])
+        if len(ano_scores) == 0:
+            print("WARNING! No anomalies in the training data, all items are forwarded to the expensive model")
+            self.threshold = -np.inf
+        else:
+            # At most this many of the lowest scoring anomalies may be left out
+            allowed_misses = int(np.floor((1 - self.target_recall) * len(ano_scores)))
+            self.threshold = ano_scores[allowed_misses]
+        self.train_forwarded_frac = float(np.mean(self.forward_mask(cheap_scores)))
+        # E.g. RarityModel on HDFS scores some anomalies as low as most normal items, so all items are forwarded
+        if len(ano_scores) and self.train_forwarded_frac > 0.95:
+            print(f"WARNING! The cheap scorer forwards {self.train_forwarded_frac:.1%} of the training items to the "
+                  f"expensive model, so the cascade saves little time. Try a lower target_recall or another "
+                  f"cheap scorer.")
+        return self
+
+    def forward_mask(self, cheap_scores):
+        if self.threshold is None:
+            raise ValueError("CascadeDetector is not calibrated. Call calibrate first.")
+        return self._clean(cheap_scores) >= self.threshold
+
+    @staticmethod
+    def _clean(cheap_scores):
+        # Missing scores, e.g. perplexity of an empty sequence, are always forwarded
+        return np.nan_to_num(np.asarray(cheap_scores, dtype=np.float64), nan=np.inf)
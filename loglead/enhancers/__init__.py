@@ -1,4 +1,5 @@
+from .cache import EnhancerCache
 from .eventlog import EventLogEnhancer
 from .sequence import SequenceEnhancer
 
-__all__ = ['EventLogEnhancer', 'SequenceEnhancer']
\ No newline at end of file
+__all__ = ['EnhancerCache', 'EventLogEnhancer', 'SequenceEnhancer']
\ No newline at end of file
@@ -0,0 +1,119 @@
+import hashlib
+import json
+import os
+import time
+
+import polars as pl
+
+__all__ = ['EnhancerCache']
+
+
+class EnhancerCache:
+    """ On-disk cache for columns produced by the enhancers, e.g. e_message_normalized,
+        e_event_drain_id or e_bert_emb.
+        Entries are keyed by a hash of the input column, the enhancer name, its parameters
+        and the LogLead and Polars versions, and stored as Parquet files in cache_dir.
+        Least recently used entries are evicted when the cache grows over max_size_mb
+        or when they have not been used for max_age_days.
+    """
+
+    _suffix = ".parquet"
+
+    def __init__(self, cache_dir, max_size_mb=10240, max_age_days=30):
+        self.cache_dir = os.path.expanduser(cache_dir)
+        self.max_size_mb = max_size_mb
+        self.max_age_days = max_age_days
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key(self, series, enhancer_name, params=None):
+        from loglead import __version__
+        key_data = {
+            "input": self._series_digest(series),
+            "enhancer": enhancer_name,
+            "params": params if params else {},
+            "loglead": __version__,
+            "polars": pl.__version__,
+        }
+        # default=str as some parameters are not json serializable, e.g. regex tuples
+        key_str = json.dumps(key_data, sort_keys=True, default=str)
+        return hashlib.sha256(key_str.encode("utf-8")).hexdigest()
+
+    def load(self, key):
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            df = pl.read_parquet(path)
+        except Exception as e:
+            print(f"WARNING! Could not read cache entry {path}: {e}. Removing it.")
+            self._remove(path)
+            return None
+        os.utime(path)  # Mark as recently used for eviction
+        return df
+
+    def store(self, key, df):
+        path = self._path(key)
+        # Write to temporary file first so that concurrent runs never read a half-written file
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        df.write_parquet(tmp_path)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        now = time.time()
+        max_age_sec = self.max_age_days * 24 * 60 * 60 if self.max_age_days is not None else None
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(self._suffix):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:  # Removed by another process
+                continue
+            if max_age_sec is not None and now - stat.st_mtime > max_age_sec:
+                self._remove(path)
+            else:
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        if self.max_size_mb is None:
+            return
+        total_size = sum(size for _, size, _ in entries)
+        max_size = self.max_size_mb * 1024 * 1024
+        # Oldest used first
+        for _, size, path in sorted(entries):
+            if total_size <= max_size:
+                break
+            self._remove(path)
+            total_size -= size
+
+    def clear(self):
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(self._suffix):
+                self._remove(os.path.join(self.cache_dir, name))
+
+    def size_mb(self):
+        return sum(os.path.getsize(os.path.join(self.cache_dir, name))
+                   for name in os.listdir(self.cache_dir) if name.endswith(self._suffix)) / (1024 * 1024)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + self._suffix)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def _series_digest(series):
+        digest = hashlib.sha256()
+        digest.update(f"{series.dtype}:{len(series)}".encode("utf-8"))
+        # Polars cannot hash lists of strings directly. Hash the lengths and the flattened values instead.
+        while isinstance(series.dtype, (pl.List, pl.Array)):
+            if isinstance(series.dtype, pl.List):
+                digest.update(series.list.len().to_numpy().tobytes())
+            series = series.explode()
+        digest.update(series.hash(seed=0).to_numpy().tobytes())
+        return digest.hexdigest()
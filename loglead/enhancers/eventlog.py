@@ -1,6 +1,12 @@
+import functools
 import hashlib
+import inspect
+import os
 
+import numpy as np
 import polars as pl
+
+from .cache import EnhancerCache
 #Lazy import inside the method.
 #from .bertembedding import BertEmbeddings
 
@@ -27,9 +33,49 @@ masking_patterns_drain = [
 __all__ = ['EventLogEnhancer']
 
 
+# Decorator for slow enhancers. When the enhancer has a cache the new e_ columns are read from it instead of
+# being recomputed. Input column is taken from the field/column argument unless input_col is given, either
+# as a column name or as a function of the enhancer arguments.
+def _cached(input_col=None):
+    def decorator(method):
+        signature = inspect.signature(method)
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if self.cache is None:
+                return method(self, *args, **kwargs)
+            bound = signature.bind(self, *args, **kwargs)
+            bound.apply_defaults()
+            params = {k: v for k, v in bound.arguments.items() if k not in ("self", "reparse")}
+            if callable(input_col):
+                column = input_col(params)
+            else:
+                column = input_col or params.get("field", params.get("column", "m_message"))
+            self._handle_prerequisites([column])
+            key = self.cache.key(self.df[column], method.__name__, params)
+            # Reparsing always recomputes but the fresh result is still stored
+            df_cached = None if bound.arguments.get("reparse") else self.cache.load(key)
+            if df_cached is not None and df_cached.height == self.df.height:
+                self.df = self.df.drop([col for col in df_cached.columns if col in self.df.columns])
+                self.df = self.df.hstack(df_cached)
+                return self.df
+            columns_before = set(self.df.columns)
+            result = method(self, *args, **kwargs)
+            new_columns = [col for col in self.df.columns if col not in columns_before and col.startswith("e_")]
+            if new_columns:
+                self.cache.store(key, self.df.select(new_columns))
+            return result
+        return wrapper
+    return decorator
+
+
 class EventLogEnhancer:
-    def __init__(self, df):
+    def __init__(self, df, cache=None):
         self.df = df
+        # Optional EnhancerCache (or path to cache folder) for reusing slow enhancements across runs
+        if isinstance(cache, (str, os.PathLike)):
+            cache = EnhancerCache(cache)
+        self.cache = cache
 
     # Helper function to check if all prerequisites exist
     def _prerequisites_exist(self, prerequisites):
@@ -69,6 +115,7 @@ class EventLogEnhancer:
     # Trigram flag to be removed after this is fixed.
     # https://github.com/pola-rs/polars/issues/10833
     # https://github.com/pola-rs/polars/issues/10890
+    @_cached()
     def trigrams(self, column="m_message"):
         self._handle_prerequisites([column])
         if "e_trigrams" not in self.df.columns:
@@ -88,6 +135,8 @@ class EventLogEnhancer:
         return [message[i:i + ngram] for i in range(len(message) - ngram + 1)]
 
     # Enrich with drain parsing results
+    # With drain_masking the raw messages are parsed instead of field
+    @_cached(input_col=lambda params: "m_message" if params["drain_masking"] else params["field"])
     def parse_drain(self, field = "e_message_normalized", drain_masking=False, reparse=False, templates=False):
         self._handle_prerequisites([field])
         if reparse or "e_event_drain_id" not in self.df.columns:
@@ -135,6 +184,7 @@ class EventLogEnhancer:
             # tm.drain.print_tree()
         return self.df 
     
+    @_cached()
     def parse_brain(self, field = "e_message_normalized", reparse=False):
         self._handle_prerequisites([field])
         if reparse or "e_event_brain_id" not in self.df.columns:
@@ -148,6 +198,7 @@ class EventLogEnhancer:
             self.df = pl.concat([self.df, df_new], how="horizontal")
         return self.df
 
+    @_cached()
     def parse_ael(self,field = "e_message_normalized",  reparse=False):
         self._handle_prerequisites([field])
         if reparse or "e_event_ael_id" not in self.df.columns:
@@ -162,6 +213,7 @@ class EventLogEnhancer:
         return self.df
 
     #New parser not yet released to public. Coming early 2024
+    @_cached()
     def parse_tip(self, field = "e_message_normalized", reparse=False, templates=False):
         self._handle_prerequisites([field])
         if reparse or "e_event_tip_id" not in self.df.columns:
@@ -200,6 +252,7 @@ class EventLogEnhancer:
             self.df = pl.concat([self.df, df_new], how="horizontal")
         return self.df
     
+    @_cached()
     def parse_iplom(self, field = "e_message_normalized", reparse=False, CT=0.35, PST=0, lower_bound=0.1):
         self._handle_prerequisites([field])
         if reparse or "e_event_iplom_id" not in self.df.columns:
@@ -228,6 +281,7 @@ class EventLogEnhancer:
         return self.df
 
     #Faster version of IPLoM coming in 2024
+    @_cached(input_col="e_words")
     def parse_pliplom(self, field = "e_message_normalized",  reparse=False, CT=0.35, FST=0, PST=0,lower_bound=0.1, single_outlier_event=True):
         self._handle_prerequisites(["e_words"]) #Check word split method https://github.com/logpai/logparser/blob/main/logparser/IPLoM/IPLoM.py#L154
         if reparse or "e_event_plimplom_id" not in self.df.columns:
@@ -248,6 +302,7 @@ class EventLogEnhancer:
         return self.df
 
     #https://github.com/keiichishima/templateminer
+    @_cached(input_col="e_words")
     def parse_lenma(self, field = "e_message_normalized",  reparse=False):
         self._handle_prerequisites(["e_words"])
         if reparse or "e_event_lenma_id" not in self.df.columns:
@@ -277,6 +332,7 @@ class EventLogEnhancer:
         return self.df
 
     #https://github.com/bave/pyspell/
+    @_cached()
     def parse_spell(self, field = "e_message_normalized",  reparse=False):
         self._handle_prerequisites([field])
         if reparse or "e_event_spell_id" not in self.df.columns:
@@ -306,6 +362,7 @@ class EventLogEnhancer:
             self.df = self.df.drop(["spell_obj", "spell_info"])
         return self.df
 
+    @_cached()
     def create_neural_emb(self, field="e_message_normalized"):
         self._handle_prerequisites([field])
         if "e_bert_emb" not in self.df.columns:
@@ -317,10 +374,14 @@ class EventLogEnhancer:
             message_trimmed_list = self.df[field].to_list()
             message_trimmed_emb_tensor = self.bert_emb_gen.create_bert_emb(message_trimmed_list)
             # Convert the eager tensor to a NumPy array
-            message_trimmed_emb_list = message_trimmed_emb_tensor.numpy()
-            bert_emb_col_df = pl.DataFrame({
-                'e_bert_emb': message_trimmed_emb_list
-            })
+            message_trimmed_emb = message_trimmed_emb_tensor.numpy().astype(np.float32, copy=False)
+            # Store as fixed width Array(Float32, dim) instead of List[f64]. Half the memory and
+            # converts back to a 2D NumPy array without copying every row.
+            n_rows, emb_dim = message_trimmed_emb.shape
+            bert_emb_col_df = pl.DataFrame(
+                pl.Series('e_bert_emb', message_trimmed_emb.ravel()).reshape((n_rows, emb_dim))
+                .cast(pl.Array(pl.Float32, emb_dim))
+            )
 
             self.df = self.df.hstack(bert_emb_col_df)
         return self.df
@@ -336,6 +397,7 @@ class EventLogEnhancer:
             )
         return self.df
 
+    @_cached(input_col="m_message")
     def normalize(self, regexs=masking_patterns_drain, to_lower=False, twice=True):
 
         # base_code = 'self.df = self.df.with_columns(e_message_normalized = pl.col("m_message").str.split("\\n").list.first()'
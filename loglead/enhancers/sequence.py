@@ -6,10 +6,119 @@ __all__ = ['SequenceEnhancer']
 
 
 class SequenceEnhancer:
+    # Features supported by aggregate(). Each one matches the method with the same name.
+    _aggregate_features = ["start_time", "end_time", "time_stamp", "seq_len", "duration", "eve_len", "events", "tokens"]
+
     def __init__(self, df, df_seq):
         self.df = df
         self.df_seq = df_seq
 
+    # Compute several sequence features with a single group_by over the event frame and a single join.
+    # Token lists are built from the list buffers (see _token_lists) and joined to the aggregated frame.
+    # Runs lazily so that the streaming engine can be used for large data.
+    # Usage: df_seq = enhancer_seq.aggregate(["seq_len", "duration", "events"], event_col="e_event_drain_id")
+    def aggregate(self, features=None, event_col="e_event_drain_id", token="e_words", streaming=False):
+        if features is None:
+            features = ["start_time", "end_time", "seq_len", "duration"]
+        unknown = [f for f in features if f not in self._aggregate_features]
+        if unknown:
+            raise ValueError(f"Unknown features for aggregation: {', '.join(unknown)}. "
+                             f"Supported features: {', '.join(self._aggregate_features)}")
+        # Allow aggregating several event or token columns at once
+        event_cols = [event_col] if isinstance(event_col, str) else list(event_col)
+        token_cols = [token] if isinstance(token, str) else list(token)
+
+        duration = pl.col('m_timestamp').max() - pl.col('m_timestamp').min()
+        feature_exprs = {
+            "start_time": [pl.col('m_timestamp').min().alias('start_time')],
+            "end_time": [pl.col('m_timestamp').max().alias('end_time')],
+            # We used median as time stamp for sequence
+            "time_stamp": [pl.col('m_timestamp').median().alias('time_stamp')],
+            # Alias e_event_id_len is compatible with the token len naming.
+            "seq_len": [pl.len().alias('seq_len'), pl.len().alias('e_event_id_len')],
+            "duration": [duration.alias('duration'), duration.dt.total_seconds().alias('duration_sec')],
+            "eve_len": [pl.col('e_chars_len').max().alias('eve_len_max'),
+                        pl.col('e_chars_len').min().alias('eve_len_min'),
+                        pl.col('e_chars_len').mean().alias('eve_len_avg'),
+                        pl.col('e_chars_len').median().alias('eve_len_med'),
+                        (pl.col('e_chars_len') > 1).sum().alias('eve_len_over1')],
+            "events": [pl.col(col).alias(col) for col in event_cols],
+            # Token lists are concatenated separately from the list buffers, see _token_lists
+            "tokens": [pl.col(col + "_len").sum().alias(col + "_len") for col in token_cols],
+        }
+        exprs = [expr for feature in dict.fromkeys(features) for expr in feature_exprs[feature]]
+        df_temp = self.df.lazy().group_by('seq_id').agg(exprs)
+        if "tokens" in features:
+            for col in token_cols:
+                df_temp = df_temp.join(self._token_lists(col).lazy(), on='seq_id')
+        # Recompute features that are already present instead of creating duplicate columns
+        new_cols = df_temp.columns[1:]
+        df_seq = self.df_seq.lazy().drop([col for col in new_cols if col in self.df_seq.columns])
+        self.df_seq = df_seq.join(df_temp, on='seq_id').collect(streaming=streaming)
+        return self.df_seq
+
+    # Create sequences for data that has no natural sequence id, e.g. BGL or Thunderbird, from windows over m_timestamp.
+    # window="fixed": non-overlapping windows of length every.
+    # window="sliding": windows of length period starting at every `every`. An event can belong to several windows.
+    # window="session": a new sequence starts when there have been no events for gap.
+    # partition_by, e.g. "node" or "component", creates separate windows for each value.
+    # Returns SequenceEnhancer with seq_id added to df and df_seq holding one row per window with anomaly labels.
+    # Usage: enhancer_seq = SequenceEnhancer.from_time_windows(df, window="sliding", every="10m", period="1h")
+    @classmethod
+    def from_time_windows(cls, df, window="fixed", every="1h", period=None, gap="5m", partition_by=None,
+                          label_col="anomaly"):
+        if window not in ("fixed", "sliding", "session"):
+            raise ValueError(f"Unknown window type: {window}. Use 'fixed', 'sliding' or 'session'")
+        if "m_timestamp" not in df.columns:
+            raise ValueError("Missing prerequisites for time windows: m_timestamp")
+        partition_cols = [] if partition_by is None else [partition_by] if isinstance(partition_by, str) \
+            else list(partition_by)
+        if "seq_id" in df.columns:
+            df = df.drop("seq_id")
+        df = df.sort(partition_cols + ["m_timestamp"])
+
+        if window == "fixed":
+            # Same windows as group_by_dynamic with period=every but each event maps to exactly one window,
+            # so it is cheaper to truncate the timestamps than to collect and explode the window members
+            df = df.with_columns(pl.col("m_timestamp").dt.truncate(every).alias("window_start"))
+            window_key = pl.col("window_start").cast(pl.Utf8)
+        elif window == "sliding":
+            if "row_nr" in df.columns:
+                df = df.drop("row_nr")
+            df = df.with_row_index("row_nr")
+            df_windows = df.group_by_dynamic("m_timestamp", every=every, period=period if period else every,
+                                             group_by=partition_cols if partition_cols else None, closed="left",
+                                             start_by="window").agg(pl.col("row_nr"))
+            # Events of overlapping windows are duplicated, one copy for each window
+            df_windows = df_windows.rename({"m_timestamp": "window_start"}).explode("row_nr")
+            df = df_windows.select("row_nr", "window_start").join(df, on="row_nr").drop("row_nr")
+            window_key = pl.col("window_start").cast(pl.Utf8)
+        else:
+            previous = pl.col("m_timestamp").shift(1)
+            gap_end = previous.dt.offset_by(gap) if isinstance(gap, str) else previous + gap
+            new_session = (pl.col("m_timestamp") > gap_end).fill_null(True)
+            session_nr = pl.col("session_nr").cast(pl.UInt32).cum_sum()
+            if partition_cols:
+                new_session = new_session.over(partition_cols)
+                session_nr = session_nr.over(partition_cols)
+            df = df.with_columns(new_session.alias("session_nr"))
+            df = df.with_columns(session_nr)
+            df = df.with_columns(pl.col("m_timestamp").min().over(partition_cols + ["session_nr"]).alias("window_start"))
+            window_key = pl.col("session_nr").cast(pl.Utf8)
+
+        df = df.with_columns(
+            pl.concat_str([pl.col(col).cast(pl.Utf8) for col in partition_cols] + [window_key], separator="_")
+            .alias("seq_id"))
+        if window == "session":
+            df = df.drop("session_nr")
+        seq_aggs = [pl.col("window_start").first()] + [pl.col(col).first() for col in partition_cols]
+        if label_col in df.columns:
+            seq_aggs.append(pl.col(label_col).any().alias(label_col))
+        df_seq = df.group_by("seq_id", maintain_order=True).agg(seq_aggs)
+        if label_col == "anomaly" and label_col in df_seq.columns:
+            df_seq = df_seq.with_columns(pl.col("anomaly").not_().alias("normal"))
+        return cls(df=df, df_seq=df_seq)
+
     def start_time(self):
         df_temp = self.df.group_by('seq_id').agg(pl.col('m_timestamp').min().alias('start_time'))
         self.df_seq = self.df_seq.join(df_temp, on='seq_id')
@@ -44,9 +153,8 @@ class SequenceEnhancer:
         return self.df_seq
 
     def tokens(self, token="e_words"):
-        # df_temp = self.df.group_by('seq_id').agg(pl.col(token).flatten().alias(token))
-        # Same as above but the above crashes due to out of memory problems. We might need this fix also in other rows
-        df_temp = self.df.select("seq_id", token).explode(token).group_by('seq_id').agg(pl.col(token))
+        # Concatenate token lists without exploding to one row per token, see _token_lists
+        df_temp = self._token_lists(token)
         # Join this result with df_sequences on seq_id
         self.df_seq = self.df_seq.join(df_temp, on='seq_id')
 
@@ -56,6 +164,49 @@ class SequenceEnhancer:
 
         return self.df_seq
 
+    # Token lists of each sequence built directly from the list buffers.
+    # Exploding to one row per token and grouping again creates a billion row intermediate frame with Thunderbird.
+    # Instead the events are sorted by seq_id so that tokens of a sequence are contiguous in the values buffer
+    # of the list column. Sequence lists then reuse the same values buffer with offsets taken from the
+    # event list offsets at sequence boundaries.
+    def _token_lists(self, token):
+        import numpy as np
+        import pyarrow as pa
+        df_sorted = self.df.select("seq_id", token).sort("seq_id", maintain_order=True)
+        runs = df_sorted["seq_id"].rle()
+        seq_ids = runs.struct.field("values").alias("seq_id")
+        event_lists = df_sorted[token].rechunk().to_arrow()
+        del df_sorted
+        event_offsets = event_lists.offsets.to_numpy()
+        seq_bounds = np.concatenate([[0], np.cumsum(runs.struct.field("lengths").to_numpy())])
+        seq_offsets = event_offsets[seq_bounds]
+        values = event_lists.values
+        # String bytes at each sequence boundary
+        seq_byte_offsets = None
+        if pa.types.is_large_string(values.type):
+            byte_offsets = np.frombuffer(values.buffers()[1], dtype=np.int64)[values.offset:values.offset + len(values) + 1]
+            seq_byte_offsets = byte_offsets[seq_offsets]
+        # Polars fails to import large_list<large_string>. Build list<string> chunks that stay below
+        # the 32 bit offset limit both in tokens and in string bytes.
+        max_chunk = 2 ** 31 - 1
+        chunks = []
+        start = 0
+        n_seqs = len(seq_ids)
+        while start < n_seqs:
+            token_start = seq_offsets[start]
+            end = np.searchsorted(seq_offsets, token_start + max_chunk, side="right") - 1
+            if seq_byte_offsets is not None:
+                byte_limit = seq_byte_offsets[start] + max_chunk
+                end = min(end, np.searchsorted(seq_byte_offsets, byte_limit, side="right") - 1)
+            end = min(max(end, start + 1), n_seqs)
+            token_end = seq_offsets[end]
+            chunk_values = values.slice(token_start, token_end - token_start).cast(pa.string())
+            chunk_offsets = pa.array(seq_offsets[start:end + 1] - token_start, type=pa.int32())
+            chunks.append(pa.ListArray.from_arrays(chunk_offsets, chunk_values))
+            start = end
+        token_lists = pl.from_arrow(pa.chunked_array(chunks, type=pa.list_(pa.string())))
+        return pl.DataFrame([seq_ids, token_lists.alias(token)])
+
     def duration(self):
         # Calculate the sequence duration for each seq_id as the difference between max and min timestamps
         df_temp = self.df.group_by('seq_id').agg(
@@ -81,9 +232,26 @@ class SequenceEnhancer:
 
     def embeddings(self, embedding_column="e_bert_emb"):
         # Aggregate by averaging the embeddings for each sequence (seq_id)
-        df_temp = self.df.select(pl.col("seq_id"), pl.col(embedding_column).list.to_struct()).unnest(embedding_column)
-        df_temp = df_temp.group_by('seq_id').mean()
-        df_temp = df_temp.select(pl.col("seq_id"), pl.concat_list(pl.col("*").exclude("seq_id")).alias(embedding_column))
+        # Sorted segment reduce in NumPy. Sorting makes the rows of each sequence contiguous so that
+        # np.add.reduceat sums them without creating a column per embedding dimension.
+        import numpy as np
+        df_temp = self.df.select("seq_id", embedding_column).sort("seq_id", maintain_order=True)
+        runs = df_temp["seq_id"].rle()
+        seq_lens = runs.struct.field("lengths").to_numpy()
+        emb_col = df_temp[embedding_column]
+        if isinstance(emb_col.dtype, pl.List):  # Older List[f64] embeddings
+            emb_col = emb_col.list.to_array(emb_col.list.len().max())
+        emb_matrix = emb_col.to_numpy()
+        emb_dim = emb_matrix.shape[1]
+        seq_starts = np.concatenate([[0], np.cumsum(seq_lens)[:-1]])
+        emb_sums = np.add.reduceat(emb_matrix, seq_starts, axis=0, dtype=np.float64) if len(seq_lens) else \
+            np.zeros((0, emb_dim))
+        emb_means = (emb_sums / seq_lens[:, None]).astype(np.float32)
+        df_temp = pl.DataFrame([
+            runs.struct.field("values").alias("seq_id"),
+            pl.Series(embedding_column, emb_means.ravel()).reshape((len(seq_lens), emb_dim))
+            .cast(pl.Array(pl.Float32, emb_dim)),
+        ])
         # Join this result with df_sequences on seq_id
         self.df_seq = self.df_seq.join(df_temp, on='seq_id')
         return self.df_seq
@@ -0,0 +1,100 @@
+import numpy as np
+from scipy.sparse import issparse
+from sklearn.neighbors import LocalOutlierFactor
+from sklearn.kernel_approximation import Nystroem
+from sklearn.linear_model import SGDOneClassSVM
+
+__all__ = ['SubsampledLOF', 'NystroemOneClassSVM']
+
+
+class SubsampledLOF:
+    """ LocalOutlierFactor (novelty=True) that keeps at most max_samples training rows as the reference set.
+        Narrow matrices, e.g. event counts, are made dense so that LOF can use a KD or ball tree index
+        instead of brute force distances. Prediction is done in chunks to bound the distance matrix memory.
+    """
+    def __init__(self, n_neighbors=20, contamination="auto", max_samples=20000, dense_max_cols=256,
+                 chunk_size=10000, random_state=None, n_jobs=None):
+        self.n_neighbors = n_neighbors
+        self.contamination = contamination
+        self.max_samples = max_samples
+        self.dense_max_cols = dense_max_cols
+        self.chunk_size = chunk_size
+        self.random_state = random_state
+        self.n_jobs = n_jobs
+        self.lof = None
+
+    def get_params(self, deep=True):
+        return {"n_neighbors": self.n_neighbors, "contamination": self.contamination,
+                "max_samples": self.max_samples, "dense_max_cols": self.dense_max_cols,
+                "chunk_size": self.chunk_size, "random_state": self.random_state, "n_jobs": self.n_jobs}
+
+    def set_params(self, **params):
+        for key, value in params.items():
+            setattr(self, key, value)
+        return self
+
+    def fit(self, X, labels=None):
+        if X.shape[0] > self.max_samples:
+            rng = np.random.default_rng(self.random_state)
+            X = X[np.sort(rng.choice(X.shape[0], self.max_samples, replace=False))]
+        self.lof = LocalOutlierFactor(n_neighbors=min(self.n_neighbors, X.shape[0] - 1),
+                                      contamination=self.contamination, novelty=True, n_jobs=self.n_jobs)
+        self.lof.fit(self._to_index_input(X))
+        return self
+
+    def predict(self, X):
+        return self._chunked(self.lof.predict, X)
+
+    def decision_function(self, X):
+        return self._chunked(self.lof.decision_function, X)
+
+    def score_samples(self, X):
+        return self._chunked(self.lof.score_samples, X)
+
+    def _chunked(self, func, X):
+        return np.concatenate([func(self._to_index_input(X[start:start + self.chunk_size]))
+                               for start in range(0, X.shape[0], self.chunk_size)])
+
+    def _to_index_input(self, X):
+        if issparse(X) and X.shape[1] <= self.dense_max_cols:
+            return X.toarray()
+        return X
+
+
+class NystroemOneClassSVM:
+    """ Linear time approximation of OneClassSVM with an RBF kernel. Nystroem approximates the kernel
+        feature map from n_components training rows, SGDOneClassSVM is trained in that space.
+    """
+    def __init__(self, nu=0.5, gamma=None, n_components=300, max_iter=1000, random_state=None):
+        self.nu = nu
+        self.gamma = gamma
+        self.n_components = n_components
+        self.max_iter = max_iter
+        self.random_state = random_state
+        self.nystroem = None
+        self.svm = None
+
+    def fit(self, X, labels=None):
+        gamma = self.gamma
+        if gamma is None:
+            # gamma="scale" of OneClassSVM: 1 / (n_features * X.var())
+            if issparse(X):
+                mean = X.mean()
+                var = X.multiply(X).mean() - mean ** 2
+            else:
+                var = X.var()
+            gamma = 1.0 / (X.shape[1] * var) if var > 0 else 1.0
+        self.nystroem = Nystroem(gamma=gamma, n_components=min(self.n_components, X.shape[0]),
+                                 random_state=self.random_state)
+        self.svm = SGDOneClassSVM(nu=self.nu, max_iter=self.max_iter, random_state=self.random_state)
+        self.svm.fit(self.nystroem.fit_transform(X))
+        return self
+
+    def predict(self, X):
+        return self.svm.predict(self.nystroem.transform(X))
+
+    def decision_function(self, X):
+        return self.svm.decision_function(self.nystroem.transform(X))
+
+    def score_samples(self, X):
+        return self.svm.score_samples(self.nystroem.transform(X))
@@ -0,0 +1,247 @@
+import numpy as np
+import polars as pl
+from scipy.sparse import csr_matrix
+
+__all__ = ['ListVectorizer', 'EventCountVectorizer', 'HashingItemVectorizer', 'ColumnHasher']
+
+
+class ListVectorizer:
+    """ Bag-of-items vectorizer for Polars List(Utf8) and List(Categorical) columns, e.g. e_words or
+        e_event_drain_id. Produces the same count matrix as CountVectorizer(analyzer=lambda x: x)
+        without turning the column into Python lists. Vocabulary is sorted like in CountVectorizer so
+        vocabulary_ and get_feature_names_out() can be used in the same way.
+    """
+
+    def __init__(self, dtype=np.int64):
+        self.dtype = dtype
+        self.vocabulary_ = None
+        self._vocab_df = None
+
+    def fit(self, series):
+        series = self._check_series(series)
+        return self._fit_items(self._flat_items(series))
+
+    def _fit_items(self, items):
+        items = items.unique().drop_nulls().cast(pl.Utf8).sort()
+        self._vocab_df = pl.DataFrame({"item": items, "code": np.arange(len(items), dtype=np.int32)})
+        # Python dict is only needed for the vocabulary, not for the data
+        self.vocabulary_ = dict(zip(items.to_list(), range(len(items))))
+        return self
+
+    def transform(self, series):
+        if self._vocab_df is None:
+            raise ValueError("ListVectorizer is not fitted. Call fit or fit_transform first.")
+        series = self._check_series(series)
+        lengths = series.list.len().fill_null(0).to_numpy()
+        codes = self._item_codes(self._flat_items(series))
+        # Items not in vocabulary are dropped like in CountVectorizer.transform.
+        # Row pointers come from the list offsets minus the dropped items before each row.
+        known = codes >= 0
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        known_before = np.zeros(len(known) + 1, dtype=np.int64)
+        np.cumsum(known, out=known_before[1:])
+        indptr = known_before[offsets]
+        X = csr_matrix((np.ones(indptr[-1], dtype=self.dtype), codes[known], indptr),
+                       shape=(len(series), len(self.vocabulary_)))
+        # Repeated items of a row are summed to counts within the row, no hash table over (row, code) is needed
+        X.sum_duplicates()
+        return X
+
+    def fit_transform(self, series):
+        return self.fit(series).transform(series)
+
+    def get_feature_names_out(self):
+        if self._vocab_df is None:
+            raise ValueError("ListVectorizer is not fitted. Call fit or fit_transform first.")
+        return self._vocab_df["item"].to_numpy()
+
+    @staticmethod
+    def _check_series(series):
+        if isinstance(series, pl.DataFrame):
+            series = series.to_series()
+        if not isinstance(series.dtype, pl.List) or series.dtype.inner not in (pl.Utf8, pl.Categorical):
+            raise ValueError(f"ListVectorizer needs a List(Utf8) or List(Categorical) column, got {series.dtype}")
+        return series
+
+    def _item_codes(self, items):
+        # Vocabulary lookup is done once per distinct item, -1 is out of vocabulary
+        uniques, item_index = _unique_items(items)
+        unique_codes = (pl.DataFrame({"item": uniques})
+                        .join(self._vocab_df, on="item", how="left")["code"].fill_null(-1).to_numpy())
+        return np.append(unique_codes, -1).astype(np.int32)[item_index]
+
+    @staticmethod
+    def _flat_items(series):
+        # Explode gives a null for empty and null lists. Leave those out so that items align with the offsets
+        return series.filter(series.list.len().fill_null(0) > 0).explode()
+
+
+class EventCountVectorizer(ListVectorizer):
+    """ Sequence x event count matrix straight from the event level frame, without building a list column
+        per sequence first. Each event gets the matrix row of its sequence and the vocabulary code of its event,
+        and these pairs are the coordinates of the CSR matrix, repeated pairs are summed to counts. Rows are in
+        the order of the given seq_ids, e.g. df_seq["seq_id"], so labels of df_seq are aligned with them.
+        Gives the same matrix as ListVectorizer on the event lists of SequenceEnhancer.events.
+    """
+
+    def __init__(self, event_col="e_event_drain_id", seq_col="seq_id", dtype=np.int64):
+        super().__init__(dtype=dtype)
+        self.event_col = event_col
+        self.seq_col = seq_col
+
+    def fit(self, df, seq_ids=None):
+        # Vocabulary from the events of seq_ids, e.g. the training sequences, or from all events
+        if seq_ids is None:
+            self._check_columns(df)
+            return self._fit_items(df[self.event_col])
+        return self._fit_items(self._events(df, seq_ids)[self.event_col])
+
+    def transform(self, df, seq_ids):
+        if self._vocab_df is None:
+            raise ValueError("EventCountVectorizer is not fitted. Call fit or fit_transform first.")
+        return self._count_matrix(self._events(df, seq_ids), len(seq_ids))
+
+    def fit_transform(self, df, seq_ids):
+        # Events of the sequences are selected only once
+        events = self._events(df, seq_ids)
+        self._fit_items(events[self.event_col])
+        return self._count_matrix(events, len(seq_ids))
+
+    def _count_matrix(self, events, n_rows):
+        # Events not in vocabulary are dropped like in CountVectorizer.transform
+        codes = self._item_codes(events[self.event_col])
+        known = codes >= 0
+        X = csr_matrix((np.ones(np.count_nonzero(known), dtype=self.dtype),
+                        (events["row"].to_numpy()[known], codes[known])), shape=(n_rows, len(self.vocabulary_)))
+        # Sums the events of the same sequence and code. Faster than a group_by over the pairs.
+        X.sum_duplicates()
+        return X
+
+    def _events(self, df, seq_ids):
+        # Events with the matrix row of their sequence. Events of other sequences are left out by the inner join.
+        self._check_columns(df)
+        seq_ids = pl.Series(self.seq_col, seq_ids)
+        rows = pl.DataFrame({self.seq_col: seq_ids, "row": np.arange(len(seq_ids), dtype=np.int64)})
+        return df.select(self.seq_col, self.event_col).join(rows, on=self.seq_col, how="inner")
+
+    def _check_columns(self, df):
+        for col in [self.seq_col, self.event_col]:
+            if col not in df.columns:
+                raise ValueError(f"Event frame does not have column {col}")
+
+
+class HashingItemVectorizer:
+    """ Bag-of-items vectorizer with a fixed number of hashed columns and no vocabulary, for List(Utf8),
+        List(Categorical) and Utf8 columns. Utf8 columns are tokenized like in CountVectorizer. Each distinct
+        item is hashed once with murmurhash3 (seed 0), so the columns are the same in every process and batch
+        and a model trained once can score streams. With alternate_sign the hash also gives the sign, which
+        keeps collisions unbiased, but then the counts are not usable by RarityModel and OOV_detector.
+        fit only records the collisions of the training items to collision_stats_.
+    """
+
+    def __init__(self, n_features=2**20, alternate_sign=False, lowercase=True, token_pattern=r"\b\w\w+\b",
+                 dtype=np.float32):
+        self.n_features = n_features
+        self.alternate_sign = alternate_sign
+        self.lowercase = lowercase
+        self.token_pattern = token_pattern
+        self.dtype = dtype
+        self.vocabulary_ = None  # No vocabulary, kept for the same interface as the other vectorizers
+        self.collision_stats_ = None
+
+    def fit(self, series):
+        uniques, _ = _unique_items(ListVectorizer._flat_items(self._item_lists(series)))
+        buckets, _ = self._hash(uniques)
+        used = len(np.unique(buckets))
+        self.collision_stats_ = {
+            "items": len(uniques),
+            "buckets_used": used,
+            "colliding_items": len(uniques) - used,  # Items that share a column with an earlier item
+            "collision_rate": (len(uniques) - used) / len(uniques) if len(uniques) else 0.0,
+        }
+        return self
+
+    def transform(self, series):
+        # Stateless, fit is not needed
+        series = self._item_lists(series)
+        lengths = series.list.len().fill_null(0).to_numpy()
+        uniques, item_index = _unique_items(ListVectorizer._flat_items(series))
+        buckets, signs = self._hash(uniques)
+        # Null items are dropped, they get the extra last slot
+        known = item_index < len(uniques)
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        known_before = np.zeros(len(known) + 1, dtype=np.int64)
+        np.cumsum(known, out=known_before[1:])
+        item_index = item_index[known]
+        X = csr_matrix((signs[item_index].astype(self.dtype), buckets[item_index], known_before[offsets]),
+                       shape=(len(series), self.n_features))
+        X.sum_duplicates()
+        if self.alternate_sign:
+            X.eliminate_zeros()
+        return X
+
+    def fit_transform(self, series):
+        return self.fit(series).transform(series)
+
+    def get_feature_names_out(self):
+        return np.array([f"hash_{i}" for i in range(self.n_features)], dtype=object)
+
+    def _item_lists(self, series):
+        if isinstance(series, pl.DataFrame):
+            series = series.to_series()
+        if series.dtype == pl.Utf8:
+            if self.lowercase:
+                series = series.str.to_lowercase()
+            return series.str.extract_all(self.token_pattern)
+        return ListVectorizer._check_series(series)
+
+    def _hash(self, uniques):
+        from sklearn.utils import murmurhash3_32
+        hashes = np.fromiter((murmurhash3_32(item, seed=0) for item in uniques), dtype=np.int64, count=len(uniques))
+        signs = np.where(hashes >= 0, 1, -1) if self.alternate_sign else np.ones(len(hashes), dtype=np.int64)
+        return (np.abs(hashes) % self.n_features).astype(np.int32), signs
+
+
+def _unique_items(items):
+    # Distinct items as Utf8 and the index of each item in them, null items get index len(uniques).
+    # Done through the categorical dictionary so that the items themselves are only handled as integer codes.
+    if items.dtype != pl.Categorical:
+        items = items.cast(pl.Categorical)
+    uniques = items.unique().drop_nulls()
+    physical = uniques.to_physical().to_numpy()
+    # Last slot is for null items
+    lookup = np.full(physical.max() + 2 if len(physical) else 1, len(uniques), dtype=np.int64)
+    lookup[physical] = np.arange(len(uniques))
+    return uniques.cast(pl.Utf8), lookup[items.to_physical().fill_null(len(lookup) - 1).to_numpy()]
+
+
+class ColumnHasher:
+    """ Feature hashing of an already vectorized matrix. Each column is added with a sign to one of
+        n_features buckets chosen by the murmurhash of the column index, like FeatureHasher does for raw
+        features. Fitting only builds the column to bucket mapping. Sparse input stays sparse.
+    """
+
+    def __init__(self, n_features=100, alternate_sign=True):
+        self.n_features = n_features
+        self.alternate_sign = alternate_sign
+        self.projection_ = None
+
+    def fit(self, X, y=None):
+        from sklearn.utils import murmurhash3_32
+        hashes = murmurhash3_32(np.arange(X.shape[1], dtype=np.int32), positive=False).astype(np.int64)
+        signs = np.where(hashes >= 0, 1, -1) if self.alternate_sign else np.ones(len(hashes))
+        self.projection_ = csr_matrix((signs.astype(np.float32), (np.arange(X.shape[1]), np.abs(hashes) % self.n_features)),
+                                      shape=(X.shape[1], self.n_features))
+        return self
+
+    def transform(self, X):
+        if self.projection_ is None:
+            raise ValueError("ColumnHasher is not fitted. Call fit or fit_transform first.")
+        if X.shape[1] != self.projection_.shape[0]:
+            raise ValueError(f"ColumnHasher was fitted with {self.projection_.shape[0]} columns, got {X.shape[1]}")
+        return X @ self.projection_
+
+    def fit_transform(self, X, y=None):
+        return self.fit(X).transform(X)
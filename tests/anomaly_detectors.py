@@ -8,7 +8,7 @@ from dotenv import load_dotenv, find_dotenv
 load_dotenv(find_dotenv())
 LOGLEAD_PATH = os.environ.get("LOGLEAD_PATH")
 sys.path.append(os.environ.get("LOGLEAD_PATH"))
-from loglead import AnomalyDetector
+from loglead import AnomalyDetector, ListVectorizer
 
 # Set up argument parser
 parser = argparse.ArgumentParser(description='Dataset Loader Configuration')
@@ -22,6 +22,278 @@ with open(config_file, 'r') as file:
 
 test_data_path = os.path.expanduser(config['root_folder'])
 test_data_path = os.path.join(test_data_path, "test_data") 
+
+
+def check_list_vectorizer(series):
+    # ListVectorizer must give the same matrix and vocabulary as CountVectorizer on item lists,
+    # also with empty and null lists and with test items outside the vocabulary
+    from sklearn.feature_extraction.text import CountVectorizer
+    series = series.cast(pl.List(pl.Utf8)).head(1000)
+    half = series.len() // 2
+    train = pl.concat([series.head(half), pl.Series(series.name, [[], None], dtype=series.dtype)])
+    test = pl.concat([series.tail(series.len() - half),
+                      pl.Series(series.name, [["not-in-the-vocabulary"], [], None], dtype=series.dtype)])
+    list_vectorizer = ListVectorizer()
+    count_vectorizer = CountVectorizer(analyzer=lambda items: items)
+    X_list = list_vectorizer.fit_transform(train)
+    X_count = count_vectorizer.fit_transform([items or [] for items in train.to_list()])
+    assert list_vectorizer.vocabulary_ == count_vectorizer.vocabulary_, "ListVectorizer vocabulary differs"
+    assert X_list.shape == X_count.shape and (X_list != X_count).nnz == 0, "ListVectorizer train matrix differs"
+    X_list = list_vectorizer.transform(test)
+    X_count = count_vectorizer.transform([items or [] for items in test.to_list()])
+    assert X_list.shape == X_count.shape and (X_list != X_count).nnz == 0, "ListVectorizer test matrix differs"
+
+
+def check_save_load(df_seq, col):
+    # Scores of a saved and loaded detector must equal the scores of the trained one
+    import tempfile
+    import numpy as np
+    sad = AnomalyDetector(item_list_col=col, print_scores=False, auc_roc=True)
+    sad.test_train_split(df_seq, test_frac=0.5)
+    for model in ["LR", "DT", "XGB", "RarityModel"]:
+        getattr(sad, f"train_{model}")()
+        df_pred = sad.score(sad.test_df)
+        assert np.allclose(df_pred["pred_ano_proba"].to_numpy(), sad.predict()["pred_ano_proba"].to_numpy()), \
+            f"{model} scores of score() and predict() differ"
+        with tempfile.TemporaryDirectory() as bundle:
+            sad.save(bundle)
+            df_loaded = AnomalyDetector.load(bundle).score(sad.test_df)
+        assert np.array_equal(df_loaded["pred_ano"].to_numpy(), df_pred["pred_ano"].to_numpy()), \
+            f"Loaded {model} predictions differ"
+        assert np.allclose(df_loaded["pred_ano_proba"].to_numpy(), df_pred["pred_ano_proba"].to_numpy()), \
+            f"Loaded {model} scores differ"
+
+
+def check_score_stream(df_seq, col):
+    # Streamed micro-batches give the scores of one pass. A budget that can be met keeps every batch in it,
+    # one that can not keeps the batches at max_batch_rows instead of shrinking them toward single rows.
+    import numpy as np
+    sad = AnomalyDetector(item_list_col=col, print_scores=False, auc_roc=True)
+    sad.test_train_split(df_seq, test_frac=0.5)
+    sad.train_LR()
+    frame = sad.test_df
+    df_one_pass = sad.score(frame)
+    for budget_ms, max_batches in [(10000, None), (1e-6, -(-frame.height // 500) + 3)]:
+        sad.batch_stats = []
+        df_stream = pl.concat(list(sad.score_stream([frame], latency_budget_ms=budget_ms, max_batch_rows=500)))
+        assert np.allclose(df_stream["pred_ano_proba"].to_numpy(), df_one_pass["pred_ano_proba"].to_numpy()), \
+            "Streamed scores differ from one pass"
+        over_budget = [stats["over_budget"] for stats in sad.batch_stats]
+        if max_batches is None:
+            assert not any(over_budget), f"Batches went over a {budget_ms} ms budget"
+        else:
+            assert all(over_budget), "Batches did not go over an impossible budget"
+            assert len(sad.batch_stats) <= max_batches, \
+                f"Impossible budget shrank the batches, {len(sad.batch_stats)} batches for {frame.height} rows"
+
+
+
+def check_rarity_partial_fit(df_seq, col):
+    # RarityModel partial_fit on two halves of the training rows must give the scores of fit on all of them,
+    # also when the first batch has only the first half of the vocabulary and the second adds the rest
+    import numpy as np
+    from scipy.sparse import diags
+    from loglead import RarityModel
+    sad = AnomalyDetector(item_list_col=col, print_scores=False)
+    sad.test_train_split(df_seq, test_frac=0.5)
+    X_train = sad.X_train.tocsr()
+    half_rows, half_cols = X_train.shape[0] // 2, X_train.shape[1] // 2
+    model = RarityModel().fit(X_train)
+    model.predict(sad.X_test)
+    model_rows = RarityModel().partial_fit(X_train[:half_rows]).partial_fit(X_train[half_rows:])
+    model_rows.predict(sad.X_test)
+    assert np.allclose(model_rows.scores, model.scores), "partial_fit on row halves differs from fit"
+    later_cols = diags((np.arange(X_train.shape[1]) >= half_cols).astype(np.float64))
+    model_cols = RarityModel().partial_fit(X_train[:, :half_cols]).partial_fit(X_train @ later_cols)
+    model_cols.predict(sad.X_test)
+    assert np.allclose(model_cols.scores, model.scores), "partial_fit with a growing vocabulary differs from fit"
+
+
+def check_oov_detector(series):
+    # OOV_detector must give the same scores on token lists and on count matrices with the list lengths,
+    # and partial_fit on two halves of the training lists the scores of fit on all of them
+    import numpy as np
+    from loglead import OOV_detector
+    series = series.cast(pl.List(pl.Utf8))
+    train, test = series.head(series.len() // 2), series.tail(series.len() - series.len() // 2)
+    half = train.len() // 2
+    vectorizer = ListVectorizer()
+    X_train, X_test = vectorizer.fit_transform(train), vectorizer.transform(test)
+    lengths = test.list.len().fill_null(0).to_numpy()
+    scores = []
+    for detector in [OOV_detector().fit(train),
+                     OOV_detector().partial_fit(train.head(half)).partial_fit(train.tail(-half))]:
+        detector.predict(test)
+        scores.append(detector.scores)
+    for detector in [OOV_detector().fit(X_train),
+                     OOV_detector().partial_fit(X_train[:half]).partial_fit(X_train[half:])]:
+        detector.predict(X_test, lengths=lengths)
+        scores.append(detector.scores)
+    assert scores[0].sum() > 0, "No out-of-vocabulary items in the test lists"
+    for name, other in zip(["token list partial_fit", "matrix fit", "matrix partial_fit"], scores[1:]):
+        assert np.array_equal(other, scores[0]), f"OOV_detector {name} scores differ from token list fit"
+
+
+def check_hashing_vectorizer(series):
+    # Collision stats of HashingItemVectorizer must match the murmurhash buckets of the distinct items, and an
+    # item must get the same column in every batch, so batches stack to the matrix of all the lists at once
+    import numpy as np
+    from scipy.sparse import vstack
+    from sklearn.utils import murmurhash3_32
+    from loglead import HashingItemVectorizer
+    series = series.cast(pl.List(pl.Utf8))
+    vectorizer = HashingItemVectorizer(n_features=64).fit(series)
+    items = set(series.explode().drop_nulls().to_list())
+    buckets = {abs(murmurhash3_32(item, seed=0)) % 64 for item in items}
+    expected = {"items": len(items), "buckets_used": len(buckets), "colliding_items": len(items) - len(buckets),
+                "collision_rate": (len(items) - len(buckets)) / len(items)}
+    assert vectorizer.collision_stats_ == expected, f"Collision stats {vectorizer.collision_stats_} != {expected}"
+    vectorizer = HashingItemVectorizer(n_features=2**12)
+    half = series.len() // 2
+    X = vectorizer.transform(series)
+    X_batches = vstack([vectorizer.transform(series.head(half)), vectorizer.transform(series.tail(-half))])
+    assert (X != X_batches).nnz == 0, "Batches hash items to different columns"
+    item = series.explode().drop_nulls()[0]
+    columns = [vectorizer.transform(pl.Series([[item] + other], dtype=pl.List(pl.Utf8))).indices
+               for other in [[], ["an-item-of-another-batch"]]]
+    assert columns[0][0] in columns[1], f"Item {item} got a different column in another batch"
+
+
+def check_column_hasher(X):
+    # ColumnHasher must send each column to the same bucket in every batch and keep sparse input sparse.
+    # Without signs the hashed rows keep the total counts of the rows.
+    import numpy as np
+    from scipy.sparse import issparse, vstack
+    from loglead import ColumnHasher
+    X = X.tocsr()
+    half = X.shape[0] // 2
+    hasher = ColumnHasher(n_features=16).fit(X)
+    X_hashed = hasher.transform(X)
+    assert issparse(X_hashed) and X_hashed.shape == (X.shape[0], 16), f"Hashed matrix has shape {X_hashed.shape}"
+    X_batches = vstack([hasher.transform(X[:half]), ColumnHasher(n_features=16).fit(X[half:]).transform(X[half:])])
+    assert abs(X_hashed - X_batches).max() == 0, "Batches hash columns to different buckets"
+    X_unsigned = ColumnHasher(n_features=16, alternate_sign=False).fit_transform(X)
+    assert np.allclose(np.asarray(X_unsigned.sum(axis=1)).ravel(), np.asarray(X.sum(axis=1)).ravel()), \
+        "Unsigned hashing changed the row totals"
+
+
+def check_scalable_detectors(df_seq, col):
+    # SubsampledLOF and NystroemOneClassSVM give one score per row, also when prediction is split into chunks
+    # and when the training rows are subsampled, and AnomalyDetector scores every test row with them
+    from loglead import SubsampledLOF, NystroemOneClassSVM
+    sad = AnomalyDetector(item_list_col=col, print_scores=False, auc_roc=True)
+    sad.test_train_split(df_seq, test_frac=0.5)
+    n_test = sad.X_test.shape[0]
+    for model in [SubsampledLOF(max_samples=500, chunk_size=300, random_state=0),
+                  NystroemOneClassSVM(n_components=50, random_state=0)]:
+        model.fit(sad.X_train_no_anos)
+        for method in ["predict", "decision_function", "score_samples"]:
+            scores = getattr(model, method)(sad.X_test)
+            assert scores.shape == (n_test,), f"{type(model).__name__}.{method} gave shape {scores.shape}"
+    for method in ["LOF", "OneClassSVM"]:
+        getattr(sad, f"train_{method}")(scalable=True)
+        df_pred = sad.score(sad.test_df)
+        assert df_pred.height == n_test and df_pred["pred_ano_proba"].null_count() == 0, \
+            f"Scalable {method} did not score every test row"
+
+
+def check_profile(df_seq, col):
+    # Profiling records one row per step with the shape of its matrix, and nothing when it is off
+    sad = AnomalyDetector(item_list_col=col, print_scores=False, profile=True)
+    sad.test_train_split(df_seq, test_frac=0.5)
+    sad.train_LR()
+    sad.score(sad.test_df)
+    df_profile = sad.profile_df
+    steps = df_profile["step"].to_list()
+    for step in ["prepare_train", "prepare_test", "test_train_split", "train", "transform", "predict"]:
+        assert step in steps, f"Step {step} was not profiled, got {steps}"
+    train = df_profile.filter(pl.col("step") == "train").row(0, named=True)
+    assert train["model"] == "LogisticRegression", f"Training was profiled as {train['model']}"
+    assert (train["rows"], train["cols"], train["nnz"]) == (*sad.X_train.shape, sad.X_train.nnz), \
+        "Profiled training matrix differs from X_train"
+    assert df_profile["wall_s"].min() >= 0 and df_profile["cpu_s"].null_count() == 0, "Bad profiled times"
+    sad.profile = False
+    sad.score(sad.test_df)
+    assert sad.profile_df.height == df_profile.height, "Steps were profiled with profile=False"
+
+
+def check_threshold_sweep(df_seq, col):
+    # threshold_sweep must give the precision, recall and F1 of flagging the scores >= threshold at every
+    # distinct score, and the best F1 at the highest of the best thresholds. Rounded scores test ties.
+    import numpy as np
+    sad = AnomalyDetector(item_list_col=col, print_scores=False)
+    sad.test_train_split(df_seq, test_frac=0.5)
+    sad.train_RarityModel()
+    sad.model.predict(sad.X_test)
+    labels = np.asarray(sad.labels_test).astype(bool)
+    for scores in [sad.model.scores, np.round(sad.model.scores, -2)]:
+        best, curve = AnomalyDetector.threshold_sweep(labels, scores)
+        thresholds = np.unique(scores)[::-1]
+        assert np.array_equal(curve["threshold"].to_numpy(), thresholds), "Sweep thresholds differ from the scores"
+        expected = {"precision": [], "recall": [], "f1": []}
+        for threshold in thresholds:
+            flagged = scores >= threshold
+            tp = np.sum(flagged & labels)
+            precision, recall = tp / flagged.sum(), tp / labels.sum()
+            expected["precision"].append(precision)
+            expected["recall"].append(recall)
+            expected["f1"].append(2 * precision * recall / (precision + recall) if tp else 0.0)
+        for name, values in expected.items():
+            assert np.allclose(curve[name].to_numpy(), values), f"Sweep {name} differs from brute force"
+        best_index = int(np.argmax(expected["f1"]))
+        assert np.isclose(best["f1"], expected["f1"][best_index]), \
+            f"Best F1 {best['f1']} differs from brute force {expected['f1'][best_index]}"
+        assert best["threshold"] == thresholds[best_index], "Best F1 is not at the highest of the best thresholds"
+
+
+def check_cascade(df_seq, col):
+    # The cascade forwards at least target_recall of the training anomalies and predicts the other items normal.
+    # A cheap scorer that forwards nearly every item, like RarityModel on HDFS words, must give a warning.
+    import io
+    import numpy as np
+    from contextlib import redirect_stdout
+    sad = AnomalyDetector(item_list_col=col, print_scores=False, auc_roc=True)
+    sad.test_train_split(df_seq, test_frac=0.5)
+    for cheap in ["RarityModel", "OOVDetector"]:
+        output = io.StringIO()
+        with redirect_stdout(output):
+            sad.train_cascade(expensive="LR", cheap=cheap, target_recall=0.9)
+        cascade = sad.model
+        warned = "WARNING!" in output.getvalue()
+        assert warned == (cascade.train_forwarded_frac > 0.95), \
+            f"Cascade with {cheap} forwarding {cascade.train_forwarded_frac:.1%} warned: {warned}"
+        labels_train = np.asarray(sad.labels_train).astype(bool)
+        cheap_scores = sad._cheap_scores(cascade.cheap, sad.X_train, sad.train_df)
+        assert cascade.forward_mask(cheap_scores)[labels_train].mean() >= 0.9, "Recall guard was not met"
+        sad.cascade_stats = []
+        df_pred = sad.score(sad.test_df)
+        forward = cascade.forward_mask(sad._cheap_scores(cascade.cheap, sad.X_test, sad.test_df))
+        assert sad.cascade_stats[-1]["forwarded"] == forward.sum(), "Cascade stats have wrong forwarded count"
+        assert df_pred["pred_ano"].to_numpy()[~forward].sum() == 0, "Items that were not forwarded were flagged"
+
+
+def check_event_count_vectorizer(df, df_seq, event_col="e_event_drain_id"):
+    # EventCountVectorizer on the event frame must give the matrix and vocabulary of ListVectorizer on the
+    # event lists of SequenceEnhancer.events, with rows in the order of df_seq["seq_id"]. Sequences are shuffled
+    # so that their order differs from the event frame, and an unknown sequence id must give an empty row.
+    from loglead import EventCountVectorizer
+    df_seq = df_seq.sample(fraction=1.0, shuffle=True, seed=0)
+    half = df_seq.height // 2
+    train, test = df_seq.head(half), df_seq.tail(-half)
+    count_vectorizer = EventCountVectorizer(event_col)
+    list_vectorizer = ListVectorizer()
+    X_count = count_vectorizer.fit_transform(df, train["seq_id"])
+    X_list = list_vectorizer.fit_transform(train[event_col])
+    assert count_vectorizer.vocabulary_ == list_vectorizer.vocabulary_, "EventCountVectorizer vocabulary differs"
+    assert X_count.shape == X_list.shape and (X_count != X_list).nnz == 0, \
+        "EventCountVectorizer train matrix differs"
+    unknown_id = "not-a-sequence" if test["seq_id"].dtype == pl.Utf8 else df["seq_id"].max() + 1
+    seq_ids = pl.concat([test["seq_id"], pl.Series("seq_id", [unknown_id], dtype=test["seq_id"].dtype)])
+    X_count = count_vectorizer.transform(df, seq_ids)
+    X_list = list_vectorizer.transform(test[event_col])
+    assert X_count.shape[0] == test.height + 1 and X_count[-1].nnz == 0, \
+        "Unknown sequence id did not give an empty row"
+    assert (X_count[:-1] != X_list).nnz == 0, "EventCountVectorizer test matrix differs"
  
 # Get all .parquet files in the directory
 all_files = glob.glob(os.path.join(test_data_path, "*.parquet"))
@@ -65,6 +337,27 @@ for dataset in datasets:
     seq_file = primary_file.replace(f"{dataset}.parquet", f"{dataset}_seq.parquet")
     if os.path.exists(seq_file):
         df_seq = pl.read_parquet(seq_file)
+        if "e_words" in df_seq.columns:
+            print("Checking ListVectorizer against CountVectorizer")
+            check_list_vectorizer(df_seq["e_words"])
+            print("Checking saved and loaded detectors")
+            check_save_load(df_seq, "e_words")
+            print("Checking streaming with latency budgets")
+            check_score_stream(df_seq, "e_words")
+            print("Checking RarityModel partial_fit against fit")
+            check_rarity_partial_fit(df_seq, "e_words")
+            print("Checking OOV_detector token lists against count matrices")
+            check_oov_detector(df_seq["e_words"])
+            print("Checking HashingItemVectorizer, ColumnHasher and the scalable detectors")
+            check_hashing_vectorizer(df_seq["e_words"])
+            check_column_hasher(ListVectorizer().fit_transform(df_seq["e_words"]))
+            check_scalable_detectors(df_seq, "e_words")
+            print("Checking step profiling")
+            check_profile(df_seq, "e_words")
+            print("Checking threshold_sweep against brute force")
+            check_threshold_sweep(df_seq, "e_words")
+            print("Checking the cascade recall guard and forwarding warning")
+            check_cascade(df_seq, "e_words")
         print(f"Running seqeuence anomaly detectors with {seq_file}")
         for col in cols_event:
             disabled_methods = set()
@@ -94,5 +387,22 @@ for dataset in datasets:
             #High training fraction to ensure we always have suffiecient samples as these are reduced dataframes 
             sad.test_train_split (df_seq, test_frac=0.2) 
             sad.evaluate_all_ads(disabled_methods=disabled_methods)
+            print("Running parallel evaluation after cached XGBoost training")
+            sad.train_XGB()
+            sad.evaluate_all_ads(disabled_methods=disabled_methods, n_jobs=2)
+            sad.repeated_splits(df_seq, n_repeats=2, test_frac=0.2, models=["XGB"], n_jobs=2)
+        if "e_event_drain_id" in df.columns and "seq_id" in df.columns:
+            if "e_event_drain_id" in df_seq.columns:
+                print("Checking EventCountVectorizer against ListVectorizer")
+                check_event_count_vectorizer(df, df_seq)
+            print("Checking that incremental training rejects event counts")
+            sad = AnomalyDetector(print_scores=False)
+            sad.use_event_counts(df)
+            try:
+                sad.train_incremental([df_seq])
+            except ValueError:
+                pass
+            else:
+                raise AssertionError("train_incremental accepted use_event_counts")
 
 print("Anomaly detectors test complete.")
\ No newline at end of file
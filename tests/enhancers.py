@@ -3,6 +3,7 @@ import glob
 import os
 import polars as pl
 import yaml
+import tempfile
 
 import argparse
 from dotenv import load_dotenv, find_dotenv
@@ -11,6 +12,7 @@ LOGLEAD_PATH = os.environ.get("LOGLEAD_PATH")
 sys.path.append(os.environ.get("LOGLEAD_PATH"))
 from loglead.loaders import BaseLoader
 from loglead.enhancers import EventLogEnhancer, SequenceEnhancer
+from loglead.enhancers.cache import EnhancerCache
 
 # Set up argument parser
 parser = argparse.ArgumentParser(description='Dataset Loader Configuration')
@@ -26,6 +28,42 @@ test_data_path = os.path.expanduser(config['root_folder'])
 test_data_path = os.path.join(test_data_path, "test_data") 
 
 
+def check_enhancer_cache(df):
+    # Cached normalize and parse_drain run twice: the second run must hit the cache with an equal frame,
+    # and a changed parameter must miss it.
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = EnhancerCache(cache_dir)
+        hits = []
+        load = cache.load
+        def counting_load(key):
+            df_cached = load(key)
+            hits.append(df_cached is not None)
+            return df_cached
+        cache.load = counting_load
+
+        def run(drain_masking=False):
+            enhancer = EventLogEnhancer(df, cache=cache)
+            enhancer.normalize()
+            return enhancer.parse_drain(drain_masking=drain_masking)
+
+        df_first = run()
+        assert hits == [False, False], f"Empty cache gave hits {hits}"
+        entries = len(os.listdir(cache_dir))
+        df_second = run()
+        assert hits[2:] == [True, True], f"Second run missed the cache {hits[2:]}"
+        assert df_second.equals(df_first), "Cached frame differs from the computed one"
+        assert len(os.listdir(cache_dir)) == entries, "Cache hit stored a new entry"
+        run(drain_masking=True)
+        assert hits[4:] == [True, False], f"Changed parameter did not miss the cache {hits[4:]}"
+        assert len(os.listdir(cache_dir)) == entries + 1, "Changed parameter was not stored"
+        # With drain_masking the raw messages are parsed. Digits are masked by normalize, so changing them
+        # keeps e_message_normalized but must still miss the drain cache.
+        enhancer = EventLogEnhancer(df.with_columns(pl.col("m_message").str.replace_all(r"\d", "7")), cache=cache)
+        enhancer.normalize()
+        enhancer.parse_drain(drain_masking=True)
+        assert hits[6:] == [False, False], f"Changed raw messages did not miss the cache {hits[6:]}"
+
+
 # Get all .parquet files in the directory
 all_files = glob.glob(os.path.join(test_data_path, "*.parquet"))
 print(f"Enhancers test starting. Test data path: {test_data_path}")
@@ -64,6 +102,8 @@ for dataset in datasets:
     df = enhancer.parse_drain()
     print("Tipping parsing",   end=", ")
     df = enhancer.parse_tip()
+    print("Enhancer cache", end=", ")
+    check_enhancer_cache(df.select("m_message").head(2000))
 
     # Enhance / Aggregate sequence level
     loader = BaseLoader(filename=None, df=None, df_seq=None)
@@ -88,8 +128,21 @@ for dataset in datasets:
         df_seq = enhancer_seq.duration()
         print("Enhancing sequence length in events")
         df_seq = enhancer_seq.seq_len()
+        print("Single pass aggregation", end=", ")
+        enhancer_agg = SequenceEnhancer(df=df, df_seq=loader.df_seq)
+        df_seq_agg = enhancer_agg.aggregate(["events", "tokens", "eve_len", "start_time", "end_time", "duration",
+                                             "seq_len"], event_col=["e_event_drain_id", "e_event_tip_id"],
+                                            token=["e_words", "e_trigrams"])
+        assert set(df_seq_agg.columns) <= set(df_seq.columns), "aggregate() produced unexpected columns"
+        assert df_seq_agg.height == df_seq.height, "aggregate() lost sequences"
         # Preparing loader for addition reduction
         loader.df_seq = df_seq
+    else:
+        print("\nCreating sequences from time windows", end=", ")
+        for window in ["fixed", "sliding", "session"]:
+            enhancer_win = SequenceEnhancer.from_time_windows(df, window=window, every="1h", period="2h", gap="5m")
+            df_seq_win = enhancer_win.aggregate(["seq_len", "duration"])
+            assert df_seq_win["seq_len"].sum() == enhancer_win.df.height, "Time windows lost events"
     loader.df = df
     # Save the data used for anomaly_detectors tests.
     loader.df.write_parquet(f"{test_data_path}/{dataset}_eh.parquet") 